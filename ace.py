@@ -8,6 +8,7 @@ import asyncpg
 from disnake.ext import commands
 
 from config import *
+from utils import configtable
 from utils.configtable import ConfigTable
 from utils.context import AceContext
 from utils.guildconfigrecord import GuildConfigRecord
@@ -59,6 +60,7 @@ class AceBot(commands.Bot):
 
         # created in login
         self.db = None
+        self._config_listener = None
 
         self.config = ConfigTable(
             self, table="config", primary="guild_id", record_class=GuildConfigRecord
@@ -71,6 +73,7 @@ class AceBot(commands.Bot):
         self.modified_times = dict()
 
         self._aiohttp_setup = False
+        self._warmed_up = False
 
     async def on_connect(self):
         self.log.info("Connected to gateway!")
@@ -111,6 +114,36 @@ class AceBot(commands.Bot):
         await self.set_status(activity_text=BOT_ACTIVITY)
         self.log.info("Ready! %s", po(self.user))
 
+        if not self._warmed_up:
+            self._warmed_up = True
+            await self.warm_up_config_tables()
+
+    @property
+    def config_tables(self):
+        tables = [self.config]
+
+        for cog_name in ("Starboard", "Moderation", "Welcome", "Roles"):
+            cog = self.get_cog(cog_name)
+            if cog is not None:
+                tables.append(cog.config)
+
+        return tables
+
+    async def warm_up_config_tables(self):
+        # load config for every guild we're in up front, instead of a guild at a time
+        guild_ids = [guild.id for guild in self.guilds]
+        start = datetime.utcnow()
+
+        results = await asyncio.gather(
+            *(config.warm_up(guild_ids) for config in self.config_tables), return_exceptions=True
+        )
+
+        for config, result in zip(self.config_tables, results):
+            if isinstance(result, Exception):
+                self.log.error("Failed warming up %s", config.table, exc_info=result)
+
+        self.log.info("Warmed up config tables in %s", datetime.utcnow() - start)
+
     async def set_status(
         self,
         status: disnake.Status = disnake.Status.online,
@@ -163,6 +196,56 @@ class AceBot(commands.Bot):
         gc = await self.config.get_entry(message.guild.id)
         return gc.prefix or DEFAULT_PREFIX
 
+    async def close(self):
+        # write-behind config updates would be lost otherwise
+        try:
+            await configtable.flush_all()
+        except Exception:
+            self.log.exception("Failed writing pending config updates on close")
+        finally:
+            await self._close_config_listener()
+            await super().close()
+
+    async def listen_config_updates(self):
+        """Connects to postgres to get notified when another process updates a config table."""
+
+        self._config_listener = await asyncpg.connect(DB_BIND)
+        self._config_listener.add_termination_listener(self._on_config_listener_lost)
+        await self._config_listener.add_listener(
+            configtable.NOTIFY_CHANNEL, configtable.on_notification
+        )
+
+    async def _close_config_listener(self):
+        if self._config_listener is None:
+            return
+
+        # closing it on purpose, so don't reconnect
+        self._config_listener.remove_termination_listener(self._on_config_listener_lost)
+
+        try:
+            await self._config_listener.close()
+        except Exception:
+            self.log.exception("Failed closing config update listener")
+
+    def _on_config_listener_lost(self, connection):
+        self.log.warning("Lost config update listener, reconnecting")
+        self.loop.create_task(self._reconnect_config_listener())
+
+    async def _reconnect_config_listener(self):
+        delay = 1.0
+
+        while True:
+            try:
+                await self.listen_config_updates()
+                break
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+
+        # anything could have changed while we weren't listening
+        configtable.evict_all()
+        self.log.info("Config update listener reconnected")
+
     def load_extensions(self):
         reloaded = list()
 
@@ -198,6 +281,7 @@ class AceBot(commands.Bot):
     async def login(self, token: str) -> None:
         self.log.info("Creating postgres pool")
         self.db = await asyncpg.create_pool(DB_BIND)
+        await self.listen_config_updates()
         self.log.info("Loading extensions")
         self.load_extensions()
         self.log.info("Logging in to discord")
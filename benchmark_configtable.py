@@ -0,0 +1,73 @@
+"""Microbenchmark of cached config record reads and memory, generated slotted records vs
+the old dict backed ones. Doesn't need a database or discord.
+
+Run with: python benchmark_configtable.py
+"""
+
+import timeit
+import tracemalloc
+
+from utils.configtable import ConfigTable, ConfigTableRecord
+
+RECORDS = 10000
+READS = 1000000
+
+COLUMNS = dict(
+    id=1,
+    guild_id=115993023636176902,
+    log_channel_id=None,
+    mute_role_id=None,
+    spam_action="MUTE",
+    spam_count=8,
+    spam_per=10,
+    mention_action=None,
+    mention_count=8,
+    mention_per=16,
+    raid=False,
+    raid_age=None,
+)
+
+
+class DictRecord(object):
+    """How records used to be stored, a dict per record and reads through __getattr__."""
+
+    _data = dict()
+
+    def __init__(self, config, record):
+        self._config = config
+        self._data = dict()
+        self._dirty = set()
+
+        for key, value in record.items():
+            self._data[key] = value
+
+    def __getattr__(self, key):
+        if key in self._data:
+            return self._data[key]
+
+
+def measure(make):
+    tracemalloc.start()
+    records = [make(dict(COLUMNS, id=idx, guild_id=idx)) for idx in range(RECORDS)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    record = records[0]
+    read = timeit.timeit("record.spam_action; record.guild_id", globals=locals(), number=READS)
+
+    return size / RECORDS, read / READS / 2
+
+
+def main():
+    config = ConfigTable(None, "mod_config", "guild_id", record_class=ConfigTableRecord)
+
+    for name, make in (
+        ("dict", lambda record: DictRecord(config, record)),
+        ("slots", config.make_record),
+    ):
+        size, read = measure(make)
+        print(f"{name:>6}: {size:.0f} bytes/record, {read * 1e9:.1f} ns/read")
+
+
+if __name__ == "__main__":
+    main()
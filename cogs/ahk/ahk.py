@@ -1,4 +1,5 @@
 import asyncio
+import hashlib
 import html
 import io
 import logging
@@ -6,6 +7,7 @@ import re
 from abc import ABCMeta, abstractmethod
 from asyncio import TimeoutError
 from base64 import b64encode
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from itertools import chain, zip_longest
 from typing import Any
@@ -14,9 +16,9 @@ import aiohttp
 import disnake
 from aiohttp import ClientTimeout
 from aiohttp.client_exceptions import ClientConnectorError
-from bs4 import BeautifulSoup
 from disnake.ext import commands, tasks
 from disnake.utils import escape_markdown
+from lxml import etree
 
 from ace import AceBot
 from cogs.mixins import AceMixin
@@ -32,6 +34,7 @@ from config import (
     GAME_PRED_URL,
 )
 from ids import *
+from utils.circuitbreaker import CircuitBreaker, CircuitOpen
 from utils.html2markdown import HTML2Markdown
 from utils.string import shorten
 
@@ -42,6 +45,11 @@ NO_RESULTS_STRING = "No results"
 AHK_COLOR = 0x95CD95
 RSS_URL = "https://www.autohotkey.com/boards/feed"
 
+# minutes between feed polls, halved when there's new posts and grown when there's none
+RSS_INTERVAL = 14.0
+RSS_MIN_INTERVAL = 4.0
+RSS_MAX_INTERVAL = 30.0
+
 DOCS_FMT = "https://www.autohotkey.com/docs/v{}/{}"
 DOCS_NO_MATCH = commands.CommandError("Sorry, couldn't find an entry similar to that.")
 
@@ -93,6 +101,7 @@ def solved_perms(inter):
 
 
 DEFAULT_PIVOT_VALUE = 0.0
+CLASSIFY_CACHE_SIZE = 1024
 
 
 class TagAskState(metaclass=ABCMeta):
@@ -266,9 +275,22 @@ class AutoHotkey(AceMixin, commands.Cog):
 
         self.forum_thread_channel = None
         self.rss_time = datetime.now(tz=timezone(timedelta(hours=1))) - timedelta(minutes=1)
+        self.rss_interval = RSS_INTERVAL
+        self._rss_state = None  # (etag, last modified), None until loaded from the db
 
         self._tag_reminder_message = dict()
 
+        # classifier results by content hash, and a breaker so a slow or dead classifier
+        # fails fast instead of holding up every new thread
+        self._classify_cache = OrderedDict()
+        self.classifier = CircuitBreaker(
+            "classifier",
+            threshold=3,
+            reset_after=60.0,
+            timeout=3.0,
+            exceptions=(aiohttp.ClientError,),
+        )
+
         self.rss.start()
         self.close_help_threads.start()
 
@@ -281,17 +303,35 @@ class AutoHotkey(AceMixin, commands.Cog):
         date_str = date_str.strip()
         return datetime.strptime(date_str[:-3] + date_str[-2:], "%Y-%m-%dT%H:%M:%S%z")
 
+    async def _classify(self, text):
+        async with self.bot.aiohttp.post(GAME_PRED_URL, data=dict(q=text)) as resp:
+            resp.raise_for_status()
+
+            json = await resp.json()
+            return json["p"]
+
     async def classify(self, text):
-        try:
-            async with self.bot.aiohttp.post(GAME_PRED_URL, data=dict(q=text)) as resp:
-                if resp.status != 200:
-                    return DEFAULT_PIVOT_VALUE
+        key = hashlib.sha256(text.encode()).digest()
+
+        pivot = self._classify_cache.get(key, None)
+        if pivot is not None:
+            self._classify_cache.move_to_end(key)
+            return pivot
 
-                json = await resp.json()
-                return json["p"]
-        except aiohttp.ClientError:
+        try:
+            pivot = await self.classifier.call(self._classify, text)
+        except CircuitOpen:
+            return DEFAULT_PIVOT_VALUE
+        except (aiohttp.ClientError, TimeoutError):
+            log.info("Classifier request failed: %s", self.classifier.stats())
             return DEFAULT_PIVOT_VALUE
 
+        self._classify_cache[key] = pivot
+        if len(self._classify_cache) > CLASSIFY_CACHE_SIZE:
+            self._classify_cache.popitem(last=False)
+
+        return pivot
+
     def make_classification_embed(self, score):
         s = (
             "Your scripting question looks like it might be about a game, which is not allowed here. "
@@ -358,7 +398,64 @@ class AutoHotkey(AceMixin, commands.Cog):
                 log.info("Archiving %s (auto archive duration: %s)", thread.name, delta)
                 await thread.edit(archived=True, reason="Auto-expired.")
 
-    @tasks.loop(minutes=14)
+    def new_feed_entries(self, data):
+        """Returns (time, entry) for entries newer than rss_time, oldest first.
+
+        Only the updated timestamp of older entries is looked at, they're not converted.
+        """
+
+        def text(entry, tag):
+            node = entry.find(tag)
+            return "" if node is None else "".join(node.itertext())
+
+        entries = []
+
+        for _, entry in etree.iterparse(io.BytesIO(data), events=("end",), tag="{*}entry"):
+            time = self.parse_date(text(entry, "{*}updated"))
+
+            if time > self.rss_time:
+                category = entry.find("{*}category")
+                entries.append(
+                    (
+                        time,
+                        dict(
+                            title=text(entry, "{*}title"),
+                            content=text(entry, "{*}content"),
+                            id=text(entry, "{*}id"),
+                            author=text(entry, "{*}author"),
+                            category=None if category is None else category.get("label"),
+                        ),
+                    )
+                )
+
+            entry.clear()
+
+        return list(reversed(entries))
+
+    async def load_rss_state(self):
+        row = await self.db.fetchrow(
+            "SELECT last_time, etag, last_modified FROM feed_state WHERE url=$1", RSS_URL
+        )
+
+        if row is None:
+            self._rss_state = (None, None)
+        else:
+            self.rss_time = row.get("last_time")
+            self._rss_state = (row.get("etag"), row.get("last_modified"))
+
+    async def save_rss_state(self):
+        etag, last_modified = self._rss_state
+
+        await self.db.execute(
+            "INSERT INTO feed_state (url, last_time, etag, last_modified) VALUES ($1, $2, $3, $4) "
+            "ON CONFLICT (url) DO UPDATE SET last_time=$2, etag=$3, last_modified=$4",
+            RSS_URL,
+            self.rss_time,
+            etag,
+            last_modified,
+        )
+
+    @tasks.loop(minutes=RSS_INTERVAL)
     async def rss(self):
         await self.bot.wait_until_ready()
 
@@ -370,31 +467,47 @@ class AutoHotkey(AceMixin, commands.Cog):
                 self.rss.stop()
                 return
 
-        async with self.bot.aiohttp.request("get", RSS_URL) as resp:
-            if resp.status != 200:
+        if self._rss_state is None:
+            await self.load_rss_state()
+
+        # conditional get, the forum answers with a 304 if the feed didn't change
+        etag, last_modified = self._rss_state
+        headers = dict()
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+        async with self.bot.aiohttp.request("get", RSS_URL, headers=headers) as resp:
+            if resp.status == 304:
+                data = None
+            elif resp.status != 200:
                 return
-            xml_rss = await resp.text("UTF-8")
+            else:
+                data = await resp.read()
+                etag = resp.headers.get("ETag", None)
+                last_modified = resp.headers.get("Last-Modified", None)
 
-        xml = BeautifulSoup(xml_rss, "xml")
+        posted = 0
+        entries = [] if data is None else self.new_feed_entries(data)
 
-        for entry in reversed(xml.find_all("entry")):
-            time = self.parse_date(str(entry.updated.text))
-            title = self.h2m.convert(str(entry.title.text))
+        for time, entry in entries:
+            title = self.h2m.convert(entry["title"])
 
-            if time > self.rss_time and "• Re: " not in title:
-                content = str(entry.content.text).split("Statistics: ")[0]
+            if "• Re: " not in title:
+                content = entry["content"].split("Statistics: ")[0]
                 content = self.h2m.convert(content)
                 content = content.replace("\nCODE: ", "")
 
                 e = disnake.Embed(
                     title=title,
                     description=content,
-                    url=str(entry.id.text),
+                    url=entry["id"],
                     color=AHK_COLOR,
                 )
 
-                e.add_field(name="Author", value=str(entry.author.text))
-                e.add_field(name="Forum", value=str(entry.category["label"]))
+                e.add_field(name="Author", value=entry["author"])
+                e.add_field(name="Forum", value=entry["category"])
                 e.set_footer(
                     text="autohotkey.com",
                     icon_url="https://www.autohotkey.com/favicon.ico",
@@ -404,7 +517,25 @@ class AutoHotkey(AceMixin, commands.Cog):
                 if self.forum_thread_channel is not None:
                     await self.forum_thread_channel.send(embed=e)
 
-                self.rss_time = time
+                posted += 1
+
+            # replies are skipped, but there's no need to look at them again next time either
+            self.rss_time = time
+
+        if data is not None:
+            self._rss_state = (etag, last_modified)
+            await self.save_rss_state()
+
+        # poll more often while the forum is busy, and back off while it's quiet
+        if posted:
+            interval = max(RSS_MIN_INTERVAL, self.rss_interval / 2)
+        else:
+            interval = min(RSS_MAX_INTERVAL, self.rss_interval * 1.5)
+
+        if interval != self.rss_interval:
+            log.debug("RSS poll interval changed to %.1f minutes", interval)
+            self.rss_interval = interval
+            self.rss.change_interval(minutes=interval)
 
     async def cloudahk_call(self, ctx, code, lang="ahk"):
         """Call to CloudAHK to run "code" written in "lang". Replies to invoking user with stdout/runtime of code."""
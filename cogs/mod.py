@@ -127,9 +127,7 @@ class CooldownByContent(commands.CooldownMapping):
 
 
 class SecurityConfigRecord(ConfigTableRecord):
-    spam_cooldown = None
-    mention_cooldown = None
-    content_cooldown = None
+    __slots__ = ("spam_cooldown", "mention_cooldown", "content_cooldown")
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -156,6 +156,24 @@ class Owner(AceMixin, commands.Cog):
         for page in paginator.pages:
             await ctx.send(page)
 
+    @commands.command()
+    async def classifier(self, ctx):
+        """Print game classifier latency and circuit breaker state."""
+
+        cog = self.bot.get_cog("AutoHotkey")
+        if cog is None:
+            raise commands.CommandError("AutoHotkey cog not loaded.")
+
+        stats = cog.classifier.stats()
+
+        for key in ("p50", "p99"):
+            if stats[key] is not None:
+                stats[key] = f"{stats[key] * 1000:.0f} ms"
+
+        stats["cached"] = len(cog._classify_cache)
+
+        await ctx.send(f"```\n{tabulate(stats.items(), headers=('Stat', 'Value'))}\n```")
+
     @commands.command()
     async def ping(self, ctx):
         """Check response time."""
@@ -201,13 +219,7 @@ class Owner(AceMixin, commands.Cog):
     async def decache(self, ctx, guild_id: int):
         """Clear cache of table data of a specific guild."""
 
-        configs = (
-            self.bot.config,
-            self.bot.get_cog("Starboard").config,
-            self.bot.get_cog("Moderation").config,
-            self.bot.get_cog("Welcome").config,
-            self.bot.get_cog("Roles").config,
-        )
+        configs = self.bot.config_tables
 
         cleared = []
 
@@ -221,6 +233,29 @@ class Owner(AceMixin, commands.Cog):
             )
         )
 
+    @commands.command()
+    async def tables(self, ctx):
+        """Print cache and contention counters of the config tables."""
+
+        configs = self.bot.config_tables
+
+        table = tabulate(
+            tabular_data=[
+                (
+                    s["table"],
+                    s["entries"],
+                    s["hits"],
+                    s["misses"],
+                    s["waits"],
+                    f"{s['load_time']:.2f}s",
+                )
+                for s in (config.stats() for config in configs)
+            ],
+            headers=("Table", "Entries", "Hits", "Misses", "Waits", "Load time"),
+        )
+
+        await ctx.send(f"```\n{table}\n```")
+
     @commands.command()
     @commands.bot_has_permissions(manage_messages=True)
     async def say(self, ctx, channel: disnake.TextChannel, *, content: str):
@@ -420,7 +420,7 @@ class Roles(AceMixin, commands.Cog):
         self.footer_tasks = dict()
         self.footer_lock = asyncio.Lock()
 
-        self.config = ConfigTable(bot, table="role", primary="guild_id")
+        self.config = ConfigTable(bot, table="role", primary="guild_id", write_behind=1.0)
 
     async def bot_check(self, ctx):
         return (ctx.channel.id, ctx.author.id) not in self.editing
@@ -32,6 +32,8 @@ SB_NOT_POSTED = commands.CommandError("Star not posted yet.")
 
 
 class StarboardConfigRecord(ConfigTableRecord):
+    __slots__ = ()
+
     @property
     def channel(self):
         if self.channel_id is None:
@@ -16,6 +16,8 @@ WELCOME_NOT_SET_UP_ERROR = commands.CommandError(
 
 
 class WelcomeRecord(ConfigTableRecord):
+    __slots__ = ()
+
     @property
     def channel(self):
         if self.channel_id is None:
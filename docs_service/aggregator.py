@@ -1,16 +1,222 @@
+import hashlib
 import json
+import multiprocessing
 import os
+import pickle
+import types
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from parsers import Entry, HeadersParser
+from parsers import Entry, HeadersParser, Parser
 from tqdm import tqdm
 
 
+def _source_hash():
+    """Hash of the code that turns pages into entries, so cached results of a previous
+    build are thrown out when the parsers (or their instances and kwargs) change."""
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    files = ["aggregator.py", "parsers.py"] + sorted(
+        f"parser_instances/{file}"
+        for file in os.listdir(f"{folder}/parser_instances")
+        if file.endswith(".py")
+    )
+
+    source_hash = hashlib.sha1()
+
+    for file in files:
+        with open(f"{folder}/{file}", "rb") as f:
+            source_hash.update(file.encode() + b"\0" + f.read() + b"\0")
+
+    return source_hash.digest()
+
+
+SOURCE_HASH = _source_hash()
+
+# parser attributes that are state rather than settings
+_PARSER_STATE = ("base", "entries", "_bs", "converter")
+
+
+def _settings_bytes(value):
+    """Stable bytes for parser settings. Functions (the lambdas in parser_instances) are
+    described by their code and the values they close over, not where they're defined."""
+
+    if isinstance(value, types.FunctionType):
+        closure = tuple(cell.cell_contents for cell in value.__closure__ or ())
+        return b"fn(%s%s%s)" % (
+            _settings_bytes(value.__code__),
+            _settings_bytes(value.__defaults__),
+            _settings_bytes(closure),
+        )
+    elif isinstance(value, types.CodeType):
+        return b"code(%s%s%s)" % (
+            value.co_code,
+            _settings_bytes(value.co_consts),
+            repr(value.co_names).encode(),
+        )
+    elif isinstance(value, (list, tuple)):
+        return b"[%s]" % b",".join(_settings_bytes(item) for item in value)
+    elif isinstance(value, dict):
+        return b"{%s}" % b",".join(
+            b"%s:%s" % (_settings_bytes(key), _settings_bytes(item))
+            for key, item in sorted(value.items(), key=lambda item: repr(item[0]))
+        )
+
+    return repr(value).encode()
+
+
+def _parser_settings(parser: Parser):
+    settings = {key: value for key, value in vars(parser).items() if key not in _PARSER_STATE}
+    return _settings_bytes((parser.__class__.__name__, settings))
+
+
+# work handed to forked pool processes. parsers carry lambdas and soups which can't
+# be pickled, so workers pick them out of their copy of this instead
+_fork_work = dict()
+
+
+def _fork_call(key, idx):
+    func, items = _fork_work[key]
+    return func(items[idx])
+
+
+def _map(func, items, workers=1):
+    """Like map(), but spread over a pool of forked processes if we have workers.
+
+    Results come back in the same order as items so merging stays deterministic. Only
+    call this from the main thread while no other threads are busy, forking a process
+    with other threads running can leave locks they held (lxml, malloc) locked forever
+    in the children.
+    """
+
+    if workers <= 1 or len(items) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        yield from tqdm(map(func, items), total=len(items))
+        return
+
+    key = id(items)
+    _fork_work[key] = (func, items)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        ) as pool:
+            # map() submits everything right away, so the workers are forked before tqdm
+            # starts its monitor thread
+            results = pool.map(partial(_fork_call, key), range(len(items)))
+            yield from tqdm(results, total=len(items))
+    finally:
+        del _fork_work[key]
+
+
+def parse_aggregators(aggs, workers=1):
+    """Runs the queued jobs of several aggregators in one pool, then merges each of them.
+
+    This is how several docs versions are parsed at the same time, sharing the pool
+    instead of each forking their own from a thread.
+    """
+
+    work = [agg._prepare() for agg in aggs]
+    results = list(_map(lambda w: w(), [w for agg_work in work for w in agg_work], workers))
+
+    start = 0
+    for agg, agg_work in zip(aggs, work):
+        agg._finish(results[start : start + len(agg_work)])
+        start += len(agg_work)
+
+
+def _parse_indices(parser: Parser, page, indices):
+    entries = []
+
+    for name, fragment in indices:
+        tag = parser.bs.find(True, id=fragment)
+        text, syntax, version = parser.tag_parse(tag)
+
+        entries.append(
+            Entry(
+                name=name,
+                primary_names=parser.name_splitter(name)[1],
+                page=page,
+                content=text or None,
+                fragment=fragment,
+                syntax=syntax,
+                version=version,
+                parents=None,
+                secondary_names=None,
+            )
+        )
+
+    return entries
+
+
+def _parse_page(folder, version, page, jobs):
+    """Runs every job for one page against a single soup, which is dropped afterwards.
+
+    Jobs are either parsers or a list of (name, fragment) from the data index. Results
+    are pickled right away since merging mutates entries later on.
+    """
+
+    soup = None
+    results = []
+
+    for job in jobs:
+        parser = job if isinstance(job, Parser) else HeadersParser(folder, version, page)
+
+        if soup is None:
+            try:
+                soup = parser.bs
+            except FileNotFoundError:
+                # pages listed in the index aren't guaranteed to exist
+                if isinstance(job, Parser):
+                    raise
+                results.append(pickle.dumps(None))
+                continue
+
+        parser.bs = soup
+
+        if isinstance(job, Parser):
+            parser.parse()
+            results.append(pickle.dumps(parser.entries))
+        else:
+            results.append(pickle.dumps(_parse_indices(parser, page, job)))
+
+    return results
+
+
 class Aggregator:
-    def __init__(self, folder, version) -> None:
+    """Collects parsers and data index entries for a docs tree, and parses them in one go.
+
+    Everything that reads the same page runs together, so each page is read and parsed
+    by lxml at most once per build, and its soup is freed as soon as those are done.
+    """
+
+    def __init__(self, folder, version, workers=1, cache=None) -> None:
         self.folder = folder
         self.version = version
+        self.workers = workers
         self.entries = dict()
         self._parsed_files = set()
+        self._jobs = []  # (key, page, job)
+        self._page_hashes = dict()
+        self._prepared = None  # (jobs, hashes, todo) between _prepare() and _finish()
+
+        # (source, page): (hash, pickled entries) from the previous build, and for this one
+        self.cache = cache or dict()
+        self.page_cache = dict()
+        self.reparsed = 0
+
+    def _hash(self, page, extra=b""):
+        page_hash = self._page_hashes.get(page, None)
+
+        if page_hash is None:
+            try:
+                with open(f"{self.folder}/{page}", "rb") as f:
+                    page_hash = hashlib.sha1(f.read()).digest()
+            except FileNotFoundError:
+                page_hash = b""
+
+            self._page_hashes[page] = page_hash
+
+        return hashlib.sha1(SOURCE_HASH + page_hash + extra).hexdigest()
 
     def bulk_parse_from_dir(self, path, parser_type, **parser_kwargs):
         return self.bulk_parse(
@@ -21,69 +227,111 @@ class Aggregator:
         )
 
     def bulk_parse(self, parsers):
-        for parser in tqdm(parsers):
-            parser.parse()
-
-            if parser.page not in self.entries:
-                # page has not been parsed before, so just plonk parser entries into aggregator entries
-                self.entries[parser.page] = parser.entries
-            else:
-                # page HAS been parsed before, so we need to weave/update entries
-                current_entries = self.entries[parser.page]
-                for fragment, entry in parser.entries.items():
-                    present_entry = current_entries.get(fragment, None)
-                    if present_entry is None:
-                        current_entries[fragment] = entry
-                    else:
-                        present_entry.merge(entry)
+        """Queues parsers to be run by parse()."""
 
+        for parser in parsers:
+            self._jobs.append(((parser.__class__.__name__, parser.page), parser.page, parser))
             self._parsed_files.add((parser.__class__, parser.page))
 
     def parse_data_index(self, file):
-        parser_cache = dict()
+        """Queues the entries of a data_index.js file to be parsed by parse()."""
 
         with open(f"{self.folder}/{file}") as f:
             index = json.loads(f.read()[12:-2])
-            for indice in tqdm(index):
-                name, page, *_ = indice
 
-                if "#" in page:
-                    page, fragment = page.split("#")
-                else:
-                    fragment = None
+        pages = dict()
 
-                if page in parser_cache:
-                    parser = parser_cache[page]
-                else:
-                    try:
-                        parser = HeadersParser(self.folder, self.version, page)
-                    except FileNotFoundError:
-                        continue
-                    parser_cache[page] = parser
-
-                tag = parser.bs.find(True, id=fragment)
-                text, syntax, version = parser.tag_parse(tag)
-
-                entry = Entry(
-                    name=name,
-                    primary_names=parser.name_splitter(name)[1],
-                    page=page,
-                    content=text or None,
-                    fragment=fragment,
-                    syntax=syntax,
-                    version=version,
-                    parents=None,
-                    secondary_names=None,
-                )
-
-                if page not in self.entries:
-                    self.entries[page] = dict()
-
-                current_entry = self.entries[page].get(fragment, None)
-                if current_entry is None:
-                    self.entries[page][fragment] = entry
+        for indice in index:
+            name, page, *_ = indice
+
+            if "#" in page:
+                page, fragment = page.split("#")
+            else:
+                fragment = None
+
+            pages.setdefault(page, []).append((name, fragment))
+
+        for page, indices in pages.items():
+            self._jobs.append((("data_index", page), page, indices))
+
+    def parse(self):
+        parse_aggregators([self], self.workers)
+
+    def _prepare(self):
+        """Figures out which queued jobs need parsing, and returns the work for those."""
+
+        jobs, self._jobs = self._jobs, []
+
+        # parser hashes cover the parser's settings, and the data index hash its entries
+        # for the page, so changing either only causes the pages they touch to be parsed again
+        hashes = [
+            self._hash(
+                page, _parser_settings(job) if isinstance(job, Parser) else json.dumps(job).encode()
+            )
+            for _, page, job in jobs
+        ]
+
+        todo = dict()  # page: [job idx]
+        for idx, (key, page, _) in enumerate(jobs):
+            if self.cache.get(key, (None, None))[0] != hashes[idx]:
+                todo.setdefault(page, []).append(idx)
+
+        self._prepared = (jobs, hashes, todo)
+
+        return [
+            partial(_parse_page, self.folder, self.version, page, [jobs[idx][2] for idx in idxs])
+            for page, idxs in todo.items()
+        ]
+
+    def _finish(self, work_results):
+        """Merges the results of the work from _prepare(), in the same order."""
+
+        jobs, hashes, todo = self._prepared
+        self._prepared = None
+
+        results = dict()
+        for idxs, page_results in zip(todo.values(), work_results):
+            results.update(zip(idxs, page_results))
+
+        self.reparsed += len(results)
+
+        # merge in the order things were queued, regardless of how pages were grouped
+        for idx, (key, page, job) in enumerate(jobs):
+            data = results[idx] if idx in results else self.cache[key][1]
+            self.page_cache[key] = (hashes[idx], data)
+
+            if isinstance(job, Parser):
+                self._merge_parser_entries(page, pickle.loads(data))
+            else:
+                self._merge_index_entries(page, pickle.loads(data))
+
+    def _merge_parser_entries(self, page, entries):
+        if page not in self.entries:
+            # page has not been parsed before, so just plonk parser entries into aggregator entries
+            self.entries[page] = entries
+        else:
+            # page HAS been parsed before, so we need to weave/update entries
+            current_entries = self.entries[page]
+            for fragment, entry in entries.items():
+                present_entry = current_entries.get(fragment, None)
+                if present_entry is None:
+                    current_entries[fragment] = entry
                 else:
-                    current_entry.merge(entry)
+                    present_entry.merge(entry)
+
+    def _merge_index_entries(self, page, entries):
+        if entries is None:
+            return
+
+        if page not in self.entries:
+            self.entries[page] = dict()
+
+        for entry in entries:
+            current_entry = self.entries[page].get(entry.fragment, None)
+            if current_entry is None:
+                self.entries[page][entry.fragment] = entry
+            else:
+                current_entry.merge(entry)
 
     def iter_entries(self):
         for entries in self.entries.values():
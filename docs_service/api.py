@@ -1,11 +1,16 @@
-import re
+import asyncio
 from collections import defaultdict
-from random import choices
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hmac import compare_digest
+from threading import Event
 
 import asyncpg
-from rapidfuzz import fuzz, process
+from cache import LRUCache
 from sanic import Blueprint, Request, Sanic
+from sanic.log import logger
 from sanic.response import HTTPResponse, json
+from search import SearchIndex, docs_search, processor
 
 import config
 
@@ -13,42 +18,19 @@ app = Sanic("ahkdocs_api")
 
 api = Blueprint("api", url_prefix="/api")
 
+CACHE_SIZE = getattr(config, "DOCS_CACHE_SIZE", 4096)
+CACHE_TTL = getattr(config, "DOCS_CACHE_TTL", None)
 
-meaning_scalar = lambda v: 1 / ((v * 0.5) ** 2 + 1)
+# threads running docs_search, and rapidfuzz workers used by each of those
+SEARCH_THREADS = getattr(config, "DOCS_SEARCH_THREADS", 4)
+SEARCH_WORKERS = getattr(config, "DOCS_SEARCH_WORKERS", 1)
 
+# the bot gives up after 4 seconds, no point in scoring for longer than that
+SEARCH_TIMEOUT = getattr(config, "DOCS_SEARCH_TIMEOUT", 4.0)
 
-def processor(s):
-    s = s.strip().lower()
-    return re.sub(r"(\(|\))", "", s)
-
-
-def docs_search(names, query, k):
-    query = query.strip()
-
-    if not query:
-        return choices(names, k=k)
-
-    word_scores = []
-
-    splitters = [query]
-    splitters.extend(query.split(" "))
-    scores = defaultdict(float)
-
-    for i, word in enumerate(splitters):
-        word_scores = process.extract(
-            query=word,
-            choices=names,
-            scorer=fuzz.WRatio,
-            processor=processor,
-            limit=100,
-        )
-
-        for name, score, _ in word_scores:
-            scores[name] += score * meaning_scalar(i)
-
-    return list(name for name, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True))[
-        :k
-    ]
+# POST /api/reload is only enabled when a token is set
+RELOAD_TOKEN = getattr(config, "DOCS_RELOAD_TOKEN", None)
+RELOAD_CHANNEL = "docs_reload"
 
 
 def entry_to_dict(row):
@@ -64,32 +46,143 @@ def entry_to_dict(row):
     )
 
 
-async def get_entry(conn: asyncpg.Connection, docs_id: int, lineage=True, search_match=None):
-    row = await conn.fetchrow("SELECT * FROM docs_entry WHERE id=$1", docs_id)
+class DocsData:
+    """Everything the endpoints read, loaded from the database in one go.
+
+    Reloading builds a new instance and swaps it into app.ctx.docs, so handlers should
+    grab app.ctx.docs once and use that for the rest of the request.
+    """
+
+    def __init__(self, names, id_map, entries, parents, children):
+        self.names = names
+        self.id_map = id_map
+        self.entries = entries
+        self.parents = parents
+        self.children = children
+        self.index = {v: SearchIndex(names[v], workers=SEARCH_WORKERS) for v in names}
+        self.cache = LRUCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+    def get_entry(self, docs_id: int, lineage=True, search_match=None):
+        o = dict(self.entries[docs_id])
+
+        if lineage:
+            o["parents"] = [
+                self.get_entry(parent_id, lineage=False)
+                for parent_id in self.parents[docs_id]
+                if parent_id is not None  # shouldn't happen
+            ]
+            o["children"] = [
+                self.get_entry(child_id, lineage=False)
+                for child_id in self.children.get(docs_id, ())
+            ]
+            o["search_match"] = search_match
+
+        return o
+
+
+async def load_docs(pool: asyncpg.Pool) -> DocsData:
+    async with pool.acquire() as conn:
+        conn: asyncpg.Connection
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            res = await conn.fetch("SELECT * FROM docs_name")
+            id_map = {v: {} for v in (1, 2)}
+            names = {v: [] for v in (1, 2)}
+
+            for row in res:
+                v = row.get("v")
+                docs_id = row.get("docs_id")
+                name = row.get("name")
+                id_map[v][name] = docs_id
+                names[v].append(name)
+
+            # the whole entry graph is small enough to just keep around, which saves
+            # /entry from walking parents and children with one query each
+            res = await conn.fetch("SELECT * FROM docs_entry ORDER BY id")
+            entries = dict()
+            parents = dict()
+            children = defaultdict(list)
+
+            for row in res:
+                docs_id = row.get("id")
+                entry_parents = row.get("parents") or []
+                entries[docs_id] = entry_to_dict(row)
+                parents[docs_id] = entry_parents
+                if entry_parents:
+                    children[entry_parents[-1]].append(docs_id)
+
+    # building the search indexes is cpu bound, keep it off the event loop
+    return await asyncio.get_running_loop().run_in_executor(
+        app.ctx.executor, partial(DocsData, names, id_map, entries, parents, children)
+    )
+
+
+async def reload_docs():
+    # coalesce notifications that arrive while a reload is already running
+    if app.ctx.reload_pending:
+        return
+
+    app.ctx.reload_pending = True
+
+    async with app.ctx.reload_lock:
+        app.ctx.reload_pending = False
+
+        try:
+            docs = await load_docs(app.ctx.pool)
+        except Exception:
+            logger.exception("Reloading docs failed, keeping the old data")
+            return
 
-    o = entry_to_dict(row)
+        app.ctx.docs = docs
+        logger.info("Reloaded docs: %s", {v: len(names) for v, names in docs.names.items()})
 
-    if lineage:
-        parents = []
-        children = []
 
-        for parent_id in row.get("parents"):
-            if parent_id is None:  # shouldn't happen
-                continue
-            parents.append(await get_entry(conn, parent_id, lineage=False))
+def on_reload_notify(conn, pid, channel, payload):
+    logger.info("Got %s notification, reloading docs", channel)
+    app.add_task(reload_docs())
 
-        rows = await conn.fetch(
-            "SELECT * FROM docs_entry WHERE parents[array_upper(parents, 1)] = $1",
-            docs_id,
-        )
-        for row in rows:
-            children.append(entry_to_dict(row))
 
-        o["parents"] = parents
-        o["children"] = children
-        o["search_match"] = search_match
+async def listen_reload():
+    # build.py notifies on this channel once it has stored new docs
+    app.ctx.listener = await asyncpg.connect(config.DB_BIND)
+    app.ctx.listener.add_termination_listener(on_listener_lost)
+    await app.ctx.listener.add_listener(RELOAD_CHANNEL, on_reload_notify)
 
-    return o
+
+def on_listener_lost(conn):
+    logger.warning("Lost %s listener, reconnecting", RELOAD_CHANNEL)
+    app.add_task(reconnect_listener())
+
+
+async def reconnect_listener():
+    delay = 1.0
+
+    while True:
+        try:
+            await listen_reload()
+            break
+        except (OSError, asyncpg.PostgresError):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+    logger.info("Reconnected %s listener", RELOAD_CHANNEL)
+
+    # new docs might have been stored while we weren't listening
+    await reload_docs()
+
+
+async def run_search(docs: DocsData, v, q, k):
+    """Runs docs_search in the executor. Stops scoring if the request is cancelled or times out."""
+
+    cancelled = Event()
+    fut = asyncio.get_running_loop().run_in_executor(
+        app.ctx.executor, partial(docs_search, docs.index[v], q, k, cancelled=cancelled)
+    )
+
+    try:
+        return await asyncio.wait_for(fut, SEARCH_TIMEOUT)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        cancelled.set()
+        raise
 
 
 @api.post("/search")
@@ -108,9 +201,21 @@ async def search(request: Request):
     if not isinstance(q, str) or not isinstance(v, int):
         return HTTPResponse(status=400)
 
-    names = app.ctx.names[v]
+    docs: DocsData = app.ctx.docs
+
+    # empty queries give random suggestions, so those can't be cached
+    key = ("search", v, processor(q))
+    res = docs.cache.get(key) if key[2] else None
+
+    if res is None:
+        try:
+            res = await run_search(docs, v, q, k=5)
+        except asyncio.TimeoutError:
+            return HTTPResponse(status=503)
+
+        if key[2]:
+            docs.cache.set(key, res)
 
-    res = docs_search(names, q, k=5)
     return json(res)
 
 
@@ -130,38 +235,62 @@ async def entry(request: Request):
     if not isinstance(q, str) or not isinstance(v, int):
         return HTTPResponse(status=400)
 
-    names = app.ctx.names[v]
+    docs: DocsData = app.ctx.docs
 
-    res = docs_search(names, q, k=1)[0]
-    docs_id = app.ctx.id_map[v][res]
+    key = ("entry", v, processor(q))
+    o = docs.cache.get(key) if key[2] else None
+
+    if o is None:
+        try:
+            res = (await run_search(docs, v, q, k=1))[0]
+        except asyncio.TimeoutError:
+            return HTTPResponse(status=503)
+
+        docs_id = docs.id_map[v][res]
+        o = docs.get_entry(docs_id, lineage=True, search_match=res)
+        if key[2]:
+            docs.cache.set(key, o)
+
+    return json(o)
 
-    async with app.ctx.pool.acquire() as conn:
-        conn: asyncpg.Connection
-        async with conn.transaction():
-            return json(await get_entry(conn, docs_id, lineage=True, search_match=res))
+
+@api.get("/cache")
+async def cache_stats(request: Request):
+    return json(app.ctx.docs.cache.stats())
+
+
+@api.post("/reload")
+async def reload(request: Request):
+    if RELOAD_TOKEN is None:
+        return HTTPResponse(status=404)
+
+    if not compare_digest(request.headers.get("Authorization", ""), RELOAD_TOKEN):
+        return HTTPResponse(status=401)
+
+    app.add_task(reload_docs())
+    return HTTPResponse(status=202)
 
 
 @app.signal("server.init.before")
 async def setup(app, loop):
-    pool = await asyncpg.create_pool(config.DB_BIND)
+    app.ctx.pool = await asyncpg.create_pool(config.DB_BIND)
+    app.ctx.executor = ThreadPoolExecutor(
+        max_workers=SEARCH_THREADS, thread_name_prefix="docs_search"
+    )
+    app.ctx.reload_lock = asyncio.Lock()
+    app.ctx.reload_pending = False
+    app.ctx.docs = await load_docs(app.ctx.pool)
 
-    async with pool.acquire() as conn:
-        conn: asyncpg.Connection
-        async with conn.transaction():
-            res = await conn.fetch("SELECT * FROM docs_name")
-            id_map = {v: {} for v in (1, 2)}
-            names = {v: [] for v in (1, 2)}
+    await listen_reload()
 
-            for row in res:
-                v = row.get("v")
-                docs_id = row.get("docs_id")
-                name = row.get("name")
-                id_map[v][name] = docs_id
-                names[v].append(name)
 
-    app.ctx.names = names
-    app.ctx.id_map = id_map
-    app.ctx.pool = pool
+@app.signal("server.shutdown.after")
+async def teardown(app, loop):
+    # closing it on purpose, so don't reconnect
+    app.ctx.listener.remove_termination_listener(on_listener_lost)
+    await app.ctx.listener.close()
+    app.ctx.executor.shutdown(wait=False, cancel_futures=True)
+    await app.ctx.pool.close()
 
 
 app.blueprint(api)
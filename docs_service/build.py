@@ -2,11 +2,13 @@ import asyncio
 import os
 import re
 import shutil
+import sys
+from time import perf_counter
 from zipfile import ZipFile
 
 import aiohttp
 import asyncpg
-from aggregator import Aggregator
+from aggregator import Aggregator, parse_aggregators
 from bs4 import BeautifulSoup
 from parser_instances.common import command, default
 from parser_instances.v1 import get as v1_get
@@ -15,6 +17,9 @@ from parsers import HeadersParser
 
 import config
 
+# processes used for parsing, shared by both docs versions
+PARSE_WORKERS = getattr(config, "DOCS_PARSE_WORKERS", os.cpu_count() or 1)
+
 
 async def view_h(parsers, base, path):
     folder = base
@@ -51,44 +56,167 @@ async def view_h(parsers, base, path):
             print(h)
 
 
-async def store(pool: asyncpg.Pool, agg: Aggregator, version: int, id_start_at=1):
-    print("storing version", version, "starting at id", id_start_at)
-    print(agg.entry_count, "entries")
-    print(len(agg.name_map()), "names")
+ENTRY_COLUMNS = ("id", "v", "name", "page", "fragment", "content", "syntax", "version", "parents")
+NAME_COLUMNS = ("v", "docs_id", "name")
+PAGE_COLUMNS = ("v", "source", "page", "hash", "entries")
 
-    entry_sql = (
-        "INSERT INTO docs_entry (id, v, name, page, fragment, content, syntax, version, parents) "
-        "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)"
-    )
 
-    name_sql = "INSERT INTO docs_name (v, docs_id, name) VALUES ($1, $2, $3)"
-
-    agg.assign_ids(id_start_at)
-
-    ent = [
-        (
-            entry.id,
-            version,
-            entry.name,
-            entry.page,
-            entry.fragment,
-            entry.content if entry.content else None,
-            entry.syntax,
-            entry.version,
-            [e.id for e in entry.parents or []],
-        )
-        for entry in agg.iter_entries()
-    ]
+async def load_page_cache(pool: asyncpg.Pool, version: int):
+    rows = await pool.fetch("SELECT * FROM docs_page WHERE v = $1", version)
+    return {
+        (row.get("source"), row.get("page")): (row.get("hash"), row.get("entries")) for row in rows
+    }
+
+
+def affected(status):
+    # asyncpg returns the command tag, like "INSERT 0 12" or "DELETE 3"
+    return int(status.split()[-1])
+
+
+async def copy(conn: asyncpg.Connection, table, records, columns):
+    start = perf_counter()
+    await conn.copy_records_to_table(table, records=records, columns=columns)
+    elapsed = perf_counter() - start
+
+    print(f"copied {len(records)} rows to {table} ({len(records) / max(elapsed, 1e-6):.0f} rows/s)")
+
+
+async def store(pool: asyncpg.Pool, aggs: list[Aggregator]):
+    """Applies the difference between the aggregators and the database in one transaction.
 
-    names = [(version, _id, name) for name, _id in agg.name_map().items()]
+    New data is COPYed into staging tables first and then merged with a handful of
+    set based statements, so the write transaction stays short and readers only ever
+    see the old or the new docs. Entries are matched to existing rows on
+    (v, page, fragment) and keep their id.
+    """
+
+    versions = [agg.version for agg in aggs]
 
     async with pool.acquire() as conn:
         conn: asyncpg.Connection
+
+        rows = await conn.fetch("SELECT id, v, page, fragment FROM docs_entry")
+        ids = {(row.get("v"), row.get("page"), row.get("fragment")): row.get("id") for row in rows}
+        next_id = max(ids.values(), default=0) + 1
+
+        entries = []
+        names = []
+
+        for agg in aggs:
+            print("storing version", agg.version)
+            print(agg.entry_count, "entries")
+
+            for entry in agg.iter_entries():
+                entry.id = ids.get((agg.version, entry.page, entry.fragment), None)
+                if entry.id is None:
+                    entry.id = next_id
+                    next_id += 1
+
+            for entry in agg.iter_entries():
+                entries.append(
+                    (
+                        entry.id,
+                        agg.version,
+                        entry.name,
+                        entry.page,
+                        entry.fragment,
+                        entry.content if entry.content else None,
+                        entry.syntax,
+                        entry.version,
+                        [e.id for e in entry.parents or []],
+                    )
+                )
+
+            name_map = agg.name_map()
+            print(len(name_map), "names")
+
+            names.extend((agg.version, _id, name) for name, _id in name_map.items())
+
+        pages = [
+            (agg.version, source, page, page_hash, data)
+            for agg in aggs
+            for (source, page), (page_hash, data) in agg.page_cache.items()
+        ]
+
+        start = perf_counter()
+
         async with conn.transaction():
-            await conn.executemany(entry_sql, ent)
-            await conn.executemany(name_sql, names)
+            await conn.execute(
+                "CREATE TEMPORARY TABLE docs_entry_staging (LIKE docs_entry) ON COMMIT DROP"
+            )
+            await conn.execute(
+                "CREATE TEMPORARY TABLE docs_name_staging "
+                "(v SMALLINT, docs_id INT, name TEXT) ON COMMIT DROP"
+            )
+
+            await copy(conn, "docs_entry_staging", entries, ENTRY_COLUMNS)
+            await copy(conn, "docs_name_staging", names, NAME_COLUMNS)
+
+            entry_inserts = await conn.execute(
+                "INSERT INTO docs_entry SELECT s.* FROM docs_entry_staging s "
+                "WHERE NOT EXISTS (SELECT 1 FROM docs_entry e WHERE e.id = s.id)"
+            )
+            entry_updates = await conn.execute(
+                "UPDATE docs_entry e SET v = s.v, name = s.name, page = s.page, "
+                "fragment = s.fragment, content = s.content, syntax = s.syntax, "
+                "version = s.version, parents = s.parents "
+                "FROM docs_entry_staging s WHERE e.id = s.id AND "
+                "(e.v, e.name, e.page, e.fragment, e.content, e.syntax, e.version, e.parents) "
+                "IS DISTINCT FROM "
+                "(s.v, s.name, s.page, s.fragment, s.content, s.syntax, s.version, s.parents)"
+            )
+
+            name_deletes = await conn.execute(
+                "DELETE FROM docs_name n WHERE n.v = ANY($1) AND NOT EXISTS "
+                "(SELECT 1 FROM docs_name_staging s WHERE s.v = n.v AND s.name = n.name)",
+                versions,
+            )
+            name_updates = await conn.execute(
+                "UPDATE docs_name n SET docs_id = s.docs_id FROM docs_name_staging s "
+                "WHERE s.v = n.v AND s.name = n.name AND s.docs_id <> n.docs_id"
+            )
+            name_inserts = await conn.execute(
+                "INSERT INTO docs_name (v, docs_id, name) "
+                "SELECT s.v, s.docs_id, s.name FROM docs_name_staging s WHERE NOT EXISTS "
+                "(SELECT 1 FROM docs_name n WHERE n.v = s.v AND n.name = s.name)"
+            )
+
+            await conn.execute(
+                "DELETE FROM docs_syntax WHERE docs_id IN (SELECT id FROM docs_entry e "
+                "WHERE e.v = ANY($1) AND NOT EXISTS "
+                "(SELECT 1 FROM docs_entry_staging s WHERE s.id = e.id))",
+                versions,
+            )
+            entry_deletes = await conn.execute(
+                "DELETE FROM docs_entry e WHERE e.v = ANY($1) AND NOT EXISTS "
+                "(SELECT 1 FROM docs_entry_staging s WHERE s.id = e.id)",
+                versions,
+            )
+
+            # hashes and parse results for the next incremental build
+            await conn.execute("DELETE FROM docs_page WHERE v = ANY($1)", versions)
+            await copy(conn, "docs_page", pages, PAGE_COLUMNS)
+
+        print(
+            "entries:",
+            affected(entry_inserts),
+            "inserted,",
+            affected(entry_updates),
+            "updated,",
+            affected(entry_deletes),
+            "deleted",
+        )
+        print(
+            "names:",
+            affected(name_inserts),
+            "inserted,",
+            affected(name_updates),
+            "updated,",
+            affected(name_deletes),
+            "deleted",
+        )
 
-    print("finished storing version", version)
+    print(f"finished storing in {perf_counter() - start:.2f}s")
 
 
 async def downloader(url, download_to, extract_to):
@@ -119,7 +247,16 @@ async def downloader(url, download_to, extract_to):
     zip_ref.close()
 
 
-async def build_v1_aggregator(folder, download=False) -> Aggregator:
+def queue_docs(agg: Aggregator, parsers) -> Aggregator:
+    agg.bulk_parse(parsers)
+    agg.bulk_parse_from_dir("lib", parser_type=HeadersParser, **command)
+    agg.bulk_parse_from_dir("misc", parser_type=HeadersParser, **default())
+    agg.parse_data_index("static/source/data_index.js")
+
+    return agg
+
+
+async def build_v1_aggregator(folder, download=False, cache=None) -> Aggregator:
     if download:
         await downloader(
             url="https://github.com/AutoHotkey/AutoHotkeyDocs/archive/v1.zip",
@@ -127,21 +264,17 @@ async def build_v1_aggregator(folder, download=False) -> Aggregator:
             extract_to=folder,
         )
 
-    print("parsing v1 docs")
+    print("queueing v1 docs")
 
     folder += "/AutoHotkeyDocs-1/docs"
 
-    agg = Aggregator(folder=folder, version=1)
-
-    agg.bulk_parse(v1_get(folder))
-    agg.bulk_parse_from_dir("lib", parser_type=HeadersParser, **command)
-    agg.bulk_parse_from_dir("misc", parser_type=HeadersParser, **default())
-    agg.parse_data_index("static/source/data_index.js")
+    agg = Aggregator(folder=folder, version=1, cache=cache)
 
-    return agg
+    # only queues the parsing, main() parses both versions at once
+    return queue_docs(agg, v1_get(folder))
 
 
-async def build_v2_aggregator(folder, download=False) -> Aggregator:
+async def build_v2_aggregator(folder, download=False, cache=None) -> Aggregator:
     if download:
         await downloader(
             url="https://github.com/AutoHotkey/AutoHotkeyDocs/archive/v2.zip",
@@ -149,32 +282,42 @@ async def build_v2_aggregator(folder, download=False) -> Aggregator:
             extract_to=folder,
         )
 
-    print("parsing v2 docs")
+    print("queueing v2 docs")
 
     folder += "/AutoHotkeyDocs-2/docs"
 
-    agg = Aggregator(folder=folder, version=2)
+    agg = Aggregator(folder=folder, version=2, cache=cache)
 
-    agg.bulk_parse(v2_get(folder))
-    agg.bulk_parse_from_dir("lib", parser_type=HeadersParser, **command)
-    agg.bulk_parse_from_dir("misc", parser_type=HeadersParser, **default())
-    agg.parse_data_index("static/source/data_index.js")
-
-    return agg
+    # only queues the parsing, main() parses both versions at once
+    return queue_docs(agg, v2_get(folder))
 
 
-async def main():
+async def main(full=False):
     db = await asyncpg.create_pool(config.DB_BIND)
-    await db.execute("TRUNCATE docs_name, docs_entry, docs_syntax RESTART IDENTITY")
 
-    agg = await build_v1_aggregator("docs_v1", download=True)
-    await store(db, agg, 1)
-    start_at = agg.entry_count + 1
+    # a full build parses every page, otherwise only pages that changed since last time
+    caches = {v: dict() if full else await load_page_cache(db, v) for v in (1, 2)}
+
+    aggs = await asyncio.gather(
+        build_v1_aggregator("docs_v1", download=True, cache=caches[1]),
+        build_v2_aggregator("docs_v2", download=True, cache=caches[2]),
+    )
+
+    # one pool for both versions, forked from the main thread (see aggregator._map)
+    print("parsing docs")
+    parse_aggregators(aggs, workers=PARSE_WORKERS)
+
+    for agg in aggs:
+        print(
+            f"v{agg.version}: {agg.reparsed} parsed, {len(agg.page_cache) - agg.reparsed} unchanged"
+        )
 
     print()
 
-    agg = await build_v2_aggregator("docs_v2", download=True)
-    await store(db, agg, 2, id_start_at=start_at)
+    await store(db, aggs)
+
+    # tell running api instances to swap in the new docs
+    await db.execute("NOTIFY docs_reload")
 
     await db.close()
 
@@ -183,5 +326,5 @@ async def main():
 
 if __name__ == "__main__":
     loop = asyncio.new_event_loop()
-    loop.run_until_complete(main())
+    loop.run_until_complete(main(full="--full" in sys.argv))
     # loop.run_forever()
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from time import monotonic
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded least-recently-used cache where entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize=2048, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        value = self._data.get(key, _MISSING)
+
+        if value is not _MISSING:
+            expires, value = value
+            if expires is None or expires > monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._data[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        expires = None if self.ttl is None else monotonic() + self.ttl
+
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return dict(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+            hits=self.hits,
+            misses=self.misses,
+        )
@@ -0,0 +1,124 @@
+"""Checks that the narrowed docs_search gives the same results as the old full scan, on
+misspelled queries over synthetic AHK-style names. Doesn't need a database.
+
+Run with: python check_search.py
+"""
+
+import random
+import sys
+import time
+from collections import defaultdict
+
+from rapidfuzz import fuzz, process
+from search import SearchIndex, docs_search, meaning_scalar, processor
+
+NAMES = 3000
+QUERIES = 400
+K = 5
+
+WORDS = (
+    "Win Get Set Active Title Control Send Parse Class Event Loop File Reg Read Write "
+    "Wait Close Show Hide Move Text Pos Size Key State Mouse Click Pixel Search Image "
+    "Gui Menu Tray Tip Sound Beep Run Sleep Exit Reload Suspend Pause Thread Critical "
+    "Object Array Map Buffer Func Bound Call Str Replace Split Lower Upper Trim Len "
+    "Format Number Integer Float Round Mod Abs Ceil Floor Random Env Dir Drive Copy "
+    "Delete Exist Attrib Time Date Clipboard Hotkey Hotstring Input Hook Message Post "
+    "Process Priority Monitor Count Primary Work Area Edit List View Tree Status Bar"
+).split()
+
+
+def make_name(rnd):
+    words = rnd.choices(WORDS, k=rnd.choice((1, 1, 2, 2, 3)))
+    name = "".join(words)
+
+    if rnd.random() < 0.3:
+        name += "()"
+    elif rnd.random() < 0.2:
+        name = "{} {}".format(name, rnd.choice(WORDS))
+
+    return name
+
+
+def misspell(rnd, word):
+    pos = rnd.randrange(len(word))
+    op = rnd.choice(("delete", "replace", "insert", "swap"))
+    char = rnd.choice("abcdefghijklmnopqrstuvwxyz")
+
+    if op == "delete" and len(word) > 2:
+        return word[:pos] + word[pos + 1 :]
+    elif op == "replace":
+        return word[:pos] + char + word[pos + 1 :]
+    elif op == "insert":
+        return word[:pos] + char + word[pos:]
+    elif pos < len(word) - 1:
+        return word[:pos] + word[pos + 1] + word[pos] + word[pos + 2 :]
+
+    return word
+
+
+def make_query(rnd, names):
+    if rnd.random() < 0.5:
+        return misspell(rnd, rnd.choice(WORDS).lower())
+
+    words = [misspell(rnd, word) for word in rnd.choice(names).strip("()").split(" ")]
+    return " ".join(words)
+
+
+def full_scan_search(names, query, k):
+    """docs_search as it was before SearchIndex, scoring every name for every word."""
+
+    splitters = [query.strip()]
+    splitters.extend(query.strip().split(" "))
+    scores = defaultdict(float)
+
+    for i, word in enumerate(splitters):
+        for name, score, _ in process.extract(
+            word, names, scorer=fuzz.WRatio, processor=processor, limit=100
+        ):
+            scores[name] += score * meaning_scalar(i)
+
+    return list(name for name, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True))[
+        :k
+    ]
+
+
+def main():
+    rnd = random.Random(0)
+
+    names = list(dict.fromkeys(make_name(rnd) for _ in range(NAMES)))
+    queries = [make_query(rnd, names) for _ in range(QUERIES)]
+
+    index = SearchIndex(names)
+
+    mismatches = 0
+    full_time = 0.0
+    index_time = 0.0
+
+    for query in queries:
+        start = time.perf_counter()
+        expected = full_scan_search(names, query, K)
+        full_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = docs_search(index, query, K)
+        index_time += time.perf_counter() - start
+
+        if result != expected:
+            mismatches += 1
+            print("{!r}: {} != {}".format(query, result, expected))
+
+    print(
+        "{} names, {} queries, {} mismatches. full scan {:.2f}ms/query, index {:.2f}ms/query".format(
+            len(names),
+            len(queries),
+            mismatches,
+            full_time / len(queries) * 1000,
+            index_time / len(queries) * 1000,
+        )
+    )
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
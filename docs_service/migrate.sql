@@ -22,3 +22,12 @@ CREATE TABLE IF NOT EXISTS docs_syntax (
 	docs_id		INT REFERENCES docs_entry (id) NOT NULL,
 	syntax		TEXT NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS docs_page (
+    v           SMALLINT NOT NULL,
+    source      TEXT NOT NULL,
+    page        TEXT NOT NULL,
+    hash        TEXT NOT NULL,
+    entries     BYTEA NOT NULL,
+    PRIMARY KEY (v, source, page)
+);
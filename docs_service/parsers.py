@@ -123,9 +123,7 @@ class Parser:
         self.parser = "lxml"
 
         self.entries = dict()
-
-        with open(f"{self.base}/{self.page}", "r") as f:
-            self.bs = BeautifulSoup(f.read(), self.parser)
+        self._bs = None
 
         full_url = DOCS_URL_FMT.format(version) + page
         *to_join, url_file = full_url.split("/")
@@ -137,6 +135,20 @@ class Parser:
             convert=["span", "code", "a", "strong", "em"],
         )
 
+    @property
+    def bs(self):
+        # parsed on first use, so constructing a parser is cheap and the
+        # expensive part happens in whichever process actually parses it
+        if self._bs is None:
+            with open(f"{self.base}/{self.page}", "r") as f:
+                self._bs = BeautifulSoup(f.read(), self.parser)
+
+        return self._bs
+
+    @bs.setter
+    def bs(self, soup):
+        self._bs = soup
+
     def md(self, soup, **opt):
         with TemporaryOptions(self.converter, **opt):
             return self.converter.convert_soup(soup).strip()
@@ -0,0 +1,139 @@
+import re
+from collections import Counter, defaultdict
+from random import choices
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+NGRAM_SIZES = (2, 3)
+MAX_CANDIDATES = 750
+EXTRACT_LIMIT = 100
+
+meaning_scalar = lambda v: 1 / ((v * 0.5) ** 2 + 1)
+
+
+def processor(s):
+    s = s.strip().lower()
+    return re.sub(r"(\(|\))", "", s)
+
+
+def ngrams(s, n):
+    return {s[i : i + n] for i in range(len(s) - n + 1)}
+
+
+class SearchIndex:
+    """Bigram and trigram postings over a list of docs names.
+
+    Names are run through processor() once when the index is built. A query word is
+    first scored against the names sharing the most n-grams with it, and the rest of the
+    list is then only scored with the worst of the best candidates as score_cutoff. A
+    misspelled word can share no n-grams with the name it's meant to match, so the rest
+    can't be skipped, but the results are exactly those of a full scan.
+    """
+
+    def __init__(self, names, max_candidates=MAX_CANDIDATES, workers=1):
+        self.names = list(names)
+        self.processed = [processor(name) for name in self.names]
+        self.max_candidates = max_candidates
+        self.workers = workers
+
+        self._postings = defaultdict(list)
+
+        for idx, name in enumerate(self.processed):
+            for n in NGRAM_SIZES:
+                for gram in ngrams(name, n):
+                    self._postings[gram].append(idx)
+
+    def __len__(self):
+        return len(self.names)
+
+    def candidates(self, word):
+        """Returns indices of names worth scoring against word, or None for all of them."""
+
+        if len(self.names) <= self.max_candidates:
+            return None
+
+        # single characters match practically everything anyway
+        if len(word) < NGRAM_SIZES[0]:
+            return None
+
+        n = min(len(word), NGRAM_SIZES[-1])
+
+        counter = Counter()
+        for gram in ngrams(word, n):
+            counter.update(self._postings.get(gram, ()))
+
+        if len(counter) < EXTRACT_LIMIT:
+            return None
+
+        # keep original order so ties are broken the same way a full scan would
+        return sorted(idx for idx, _ in counter.most_common(self.max_candidates))
+
+    def extract(self, word, limit=EXTRACT_LIMIT):
+        """Same as process.extract with processor() over the name list, but narrowed.
+
+        Scoring goes through process.cdist which releases the GIL, so this is safe to
+        run in a thread without starving the event loop.
+        """
+
+        word = processor(word)
+        indices = self.candidates(word)
+
+        if indices is None:
+            scores = self._score(word, self.processed)
+        else:
+            scores = np.zeros(len(self.processed))
+            scores[indices] = self._score(word, [self.processed[idx] for idx in indices])
+
+            # the rest only matters if it beats the worst candidate we'd return, rapidfuzz can
+            # bail out early on names that can't reach that
+            cutoff = np.partition(scores[indices], -limit)[-limit] if len(indices) >= limit else 0
+            rest = np.ones(len(self.processed), dtype=bool)
+            rest[indices] = False
+            rest = np.flatnonzero(rest)
+
+            scores[rest] = self._score(
+                word, [self.processed[idx] for idx in rest], score_cutoff=cutoff
+            )
+
+        # stable sort so ties keep name order, the same as process.extract
+        best = np.argsort(-scores, kind="stable")[:limit]
+
+        return [(self.names[idx], float(scores[idx])) for idx in best]
+
+    def _score(self, word, choices, score_cutoff=None):
+        return process.cdist(
+            [word],
+            choices,
+            scorer=fuzz.WRatio,
+            processor=None,
+            score_cutoff=score_cutoff,
+            dtype=np.float64,
+            workers=self.workers,
+        )[0]
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+def docs_search(index: SearchIndex, query, k, cancelled=None):
+    query = query.strip()
+
+    if not query:
+        return choices(index.names, k=k)
+
+    splitters = [query]
+    splitters.extend(query.split(" "))
+    scores = defaultdict(float)
+
+    for i, word in enumerate(splitters):
+        if cancelled is not None and cancelled.is_set():
+            raise SearchCancelled()
+
+        for name, score in index.extract(word):
+            scores[name] += score * meaning_scalar(i)
+
+    return list(name for name, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True))[
+        :k
+    ]
@@ -211,4 +211,12 @@ CREATE TABLE IF NOT EXISTS help_claim (
 	channel_id		BIGINT NOT NULL,
 	user_id			BIGINT NOT NULL,
 	UNIQUE			(guild_id, channel_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS feed_state (
+	id				SERIAL UNIQUE,
+	url				TEXT UNIQUE NOT NULL,
+	last_time		TIMESTAMPTZ NOT NULL,
+	etag			TEXT NULL,
+	last_modified	TEXT NULL
+);
@@ -1,54 +1,136 @@
-import pickle
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
+from embeddings import Vocab
+from export import ARTIFACT, load_eager
 from sanic import Request, Sanic
 from sanic.response import HTTPResponse, json
 from text_processor import TextProcessor
 from torch_config import EMBEDDINGS_DIR
 from torchtext.data.utils import get_tokenizer
 
-from model import TextCNN
+from model import predict_by_length
 
-app = Sanic("torch_api")
-
-embeddings = torch.load(f"{EMBEDDINGS_DIR}/vectors.pkl")
+# how long to wait for more requests to show up before running a batch, and the largest batch
+BATCH_WAIT = 0.005
+MAX_BATCH = 64
 
-model = TextCNN(
-    embeddings=embeddings,
-    n_filters=64,
-    filter_sizes=[2, 3],
-    dropout=0.0,
-)
+app = Sanic("torch_api")
 
 device = torch.device("cpu")
-model.load_state_dict(torch.load("model.pth", map_location=device))
-model.eval()
+
+# prefer the quantized torchscript artifact made by export.py, it's smaller and
+# doesn't need the embeddings loaded separately
+if os.path.isfile(ARTIFACT):
+    model = torch.jit.load(ARTIFACT, map_location=device)
+    model.eval()
+else:
+    model = load_eager("model.pth")
 
 text_processing = TextProcessor(
-    wti=pickle.load(open(f"{EMBEDDINGS_DIR}/wti.pkl", "rb")),
+    wti=Vocab.load(EMBEDDINGS_DIR),
     tokenizer=get_tokenizer("basic_english"),
     standardize=True,
     min_len=3,
 )
 
 
+class Batcher:
+    """Coalesces concurrent classification requests into a single forward pass.
+
+    Requests queue up for BATCH_WAIT seconds, are grouped by length into batches and run
+    in an executor so the event loop is free to accept more requests meanwhile.
+    """
+
+    def __init__(self, model, max_batch=MAX_BATCH, wait=BATCH_WAIT):
+        self.model = model
+        self.max_batch = max_batch
+        self.wait = wait
+
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    async def classify(self, token_lists):
+        loop = asyncio.get_running_loop()
+        futs = []
+
+        for tokens in token_lists:
+            fut = loop.create_future()
+            self._queue.put_nowait((tokens, fut))
+            futs.append(fut)
+
+        return await asyncio.gather(*futs)
+
+    def predict(self, token_lists):
+        # not padded into one tensor, that would make a prediction depend on its batch mates
+        with torch.inference_mode():
+            return predict_by_length(self.model, token_lists)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+
+            await asyncio.sleep(self.wait)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            # requests whose client went away don't need a prediction
+            batch = [(tokens, fut) for tokens, fut in batch if not fut.done()]
+            if not batch:
+                continue
+
+            try:
+                preds = await loop.run_in_executor(
+                    self._executor, self.predict, [tokens for tokens, _ in batch]
+                )
+            except Exception as exc:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                continue
+
+            for (_, fut), pred in zip(batch, preds):
+                if not fut.done():
+                    fut.set_result(pred)
+
+
 @app.post("/game")
 async def game(request: Request):
+    # a json array of texts (or {"q": [...]}) gets a list of predictions back
+    if request.content_type == "application/json":
+        data = request.json
+
+        texts = data.get("q", None) if isinstance(data, dict) else data
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return HTTPResponse(status=400)
+
+        tokens, lengths = text_processing.process_batch(texts)
+        preds = await app.ctx.batcher.classify(
+            [row[:length] for row, length in zip(tokens, lengths.tolist())]
+        )
+        return json(dict(p=preds))
+
     q = request.form.get("q", None)
 
     if q is None:
         return HTTPResponse(status=400)
 
-    tokens = text_processing.process(q)
-    x = torch.unsqueeze(tokens, dim=0)
-
-    pred = model(x)
-    pred = torch.squeeze(pred).item()
+    (pred,) = await app.ctx.batcher.classify([text_processing.process(q)])
 
     # TODO: add logging
 
     return json(dict(p=pred))
 
 
+@app.signal("server.init.before")
+async def setup(app, loop):
+    app.ctx.batcher = Batcher(model)
+    app.add_task(app.ctx.batcher.run())
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=7000)
@@ -0,0 +1,101 @@
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+from dataset import Sequencer, TextDataset
+from embeddings import Vocab
+from export import ARTIFACT, load_eager
+from text_processor import TextProcessor
+from torch.utils.data import DataLoader
+from torch_config import CORPUS_DIR, EMBEDDINGS_DIR
+from torchtext.data.utils import get_tokenizer
+
+from model import predict_by_length
+
+SEQUENCE_LEN = 380
+LATENCY_RUNS = 500
+CONSISTENCY_RUNS = 256
+
+VARIANTS = ("eager", "scripted")
+
+
+def load(variant):
+    if variant == "eager":
+        return load_eager()
+    elif variant == "scripted":
+        return torch.jit.load(ARTIFACT, map_location=torch.device("cpu"))
+
+    raise ValueError(f"Unknown variant {variant}")
+
+
+def peak_rss_mb():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(variant):
+    start = time.perf_counter()
+    model = load(variant)
+    load_time = time.perf_counter() - start
+    load_rss = peak_rss_mb()
+
+    text_processor = TextProcessor(
+        wti=Vocab.load(EMBEDDINGS_DIR),
+        tokenizer=get_tokenizer("basic_english"),
+        standardize=True,
+        min_len=3,
+    )
+
+    dataset = TextDataset.from_corpus(CORPUS_DIR, text_processor)
+    loader = DataLoader(dataset=dataset, batch_size=32, collate_fn=Sequencer(SEQUENCE_LEN))
+
+    with torch.inference_mode():
+        # single request latency, the way the api is usually hit
+        latencies = []
+        for idx in range(min(LATENCY_RUNS, len(dataset))):
+            x = dataset.get_tokens(idx).unsqueeze(0)
+            start = time.perf_counter()
+            model(x)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        # the api batches concurrent requests, that mustn't change anyone's prediction
+        token_lists = [
+            dataset.get_tokens(idx) for idx in range(min(CONSISTENCY_RUNS, len(dataset)))
+        ]
+        single = [model(tokens.unsqueeze(0)).item() for tokens in token_lists]
+        batched = predict_by_length(model, token_lists)
+        consistency = max((abs(a - b) for a, b in zip(single, batched)), default=0.0)
+
+        correct = 0
+        start = time.perf_counter()
+        for x, labels in loader:
+            predictions = model(x).squeeze(1)
+            correct += ((predictions > 0.5).float() == labels).sum().item()
+        batch_time = time.perf_counter() - start
+
+    print(f"[{variant}]")
+    print(f"load time:      {load_time:.3f}s")
+    print(f"rss after load: {load_rss:.1f} MB")
+    print(f"peak rss:       {peak_rss_mb():.1f} MB")
+    print(f"latency p50:    {percentile(latencies, 0.5):.3f} ms")
+    print(f"latency p99:    {percentile(latencies, 0.99):.3f} ms")
+    print(f"throughput:     {len(dataset) / batch_time:.0f} samples/s (batch size 32)")
+    print(f"accuracy:       {correct / len(dataset):.4f}")
+    print(f"batched vs single max diff: {consistency:.2e}")
+    print()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        # separate processes so memory usage of one doesn't leak into the other
+        for variant in VARIANTS:
+            subprocess.run([sys.executable, __file__, variant], check=True)
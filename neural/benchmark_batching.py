@@ -0,0 +1,90 @@
+import time
+
+import torch
+from dataset import BucketBatchSampler, Sequencer, TextDataset
+from embeddings import Vocab, load_vectors
+from text_processor import TextProcessor
+from torch import nn
+from torch.utils.data import DataLoader, RandomSampler
+from torch_config import CORPUS_DIR, EMBEDDINGS_DIR
+from torchtext.data.utils import get_tokenizer
+
+from model import TextCNN
+
+SEQUENCE_LEN = 380
+BATCH_SIZE = 32
+
+
+def make_loader(dataset, bucketed):
+    if bucketed:
+        batches = BucketBatchSampler(RandomSampler(dataset), dataset.lengths, BATCH_SIZE)
+        return DataLoader(
+            dataset=dataset,
+            batch_sampler=batches,
+            collate_fn=Sequencer(SEQUENCE_LEN, dynamic=True),
+        )
+
+    return DataLoader(
+        dataset=dataset,
+        batch_size=BATCH_SIZE,
+        shuffle=True,
+        collate_fn=Sequencer(SEQUENCE_LEN),
+    )
+
+
+def run_epoch(model, loader, device):
+    criterion = nn.BCELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+
+    samples = 0
+    padded = 0
+    start = time.perf_counter()
+
+    for x, labels in loader:
+        x = x.to(device)
+        labels = labels.to(device)
+
+        loss = criterion(model(x).squeeze(1), labels)
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        samples += x.size(0)
+        padded += x.numel()
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+    return time.perf_counter() - start, samples, padded / samples
+
+
+def main():
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    text_processor = TextProcessor(
+        wti=Vocab.load(EMBEDDINGS_DIR),
+        tokenizer=get_tokenizer("basic_english"),
+        standardize=True,
+        min_len=3,
+    )
+
+    dataset = TextDataset.from_corpus(CORPUS_DIR, text_processor)
+    embeddings = load_vectors(EMBEDDINGS_DIR, mmap=False)
+
+    for name, bucketed in (("fixed", False), ("bucketed", True)):
+        torch.manual_seed(0)
+        model = TextCNN(embeddings=embeddings, n_filters=64, filter_sizes=[2, 3], dropout=0.5)
+        model.to(device).train()
+
+        epoch_time, samples, avg_len = run_epoch(model, make_loader(dataset, bucketed), device)
+
+        print(f"[{name}]")
+        print(f"epoch time:     {epoch_time:.2f}s")
+        print(f"throughput:     {samples / epoch_time:.0f} samples/s")
+        print(f"avg padded len: {avg_len:.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
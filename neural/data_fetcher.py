@@ -1,30 +1,203 @@
 import asyncio
+import json
 import os
+import time
 
 import asyncpg
 from torch_config import CORPUS_DIR, DB_BIND
 
+FETCH_BATCH = 2000
+SHARD_ROWS = 10000
+
+# how far the last export got, so the next one doesn't have to read the shards to find out
+STATE_FILE = "export_state.json"
+
+LABELS = ("0", "1")
+
+
+def shard_files(folder):
+    if not os.path.isdir(folder):
+        return []
+
+    return sorted(f"{folder}/{file}" for file in os.listdir(folder) if file.endswith(".jsonl"))
+
+
+def shard_number(file):
+    return int(os.path.basename(file)[: -len(".jsonl")])
+
+
+def scan_shards(folder):
+    """Finds the highest id and the end of the last complete line in a label's shards.
+
+    Only used once, for corpora exported before there was a state file.
+    """
+
+    last_id = 0
+    position = [0, 0, 0]  # shard, rows, size
+
+    for file in shard_files(folder):
+        rows = 0
+        size = 0
+
+        with open(file, "rb") as f:
+            for line in f:
+                # an interrupted write can leave a torn last line, which is dropped
+                if not line.endswith(b"\n"):
+                    break
+
+                last_id = max(last_id, json.loads(line)["id"])
+                rows += 1
+                size += len(line)
+
+        position = [shard_number(file), rows, size]
+
+    return last_id, position
+
+
+def load_state(folder):
+    try:
+        with open(f"{folder}/{STATE_FILE}", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+
+    last_id = 0
+    shards = dict()
+
+    for label in LABELS:
+        shard_last_id, shards[label] = scan_shards(f"{folder}/{label}")
+        last_id = max(last_id, shard_last_id)
+
+        # older exports wrote a <label>/<id>.txt file per row, those are still read for training
+        if os.path.isdir(f"{folder}/{label}"):
+            last_id = max(
+                last_id,
+                *(
+                    int(file[:-4])
+                    for file in os.listdir(f"{folder}/{label}")
+                    if file.endswith(".txt") and file[:-4].isdigit()
+                ),
+            )
+
+    return dict(last_id=last_id, shards=shards)
+
+
+def save_state(folder, state):
+    # written to a temporary file first, so it's never half written
+    with open(f"{folder}/{STATE_FILE}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+    os.replace(f"{folder}/{STATE_FILE}.tmp", f"{folder}/{STATE_FILE}")
+
+
+class ShardWriter:
+    """Appends rows to numbered .jsonl shards in a folder, starting a new shard every
+    shard_rows rows. Existing shards are never rewritten.
+
+    position is [shard, rows, size] of where the last recorded export ended. Anything
+    written past it is from an interrupted run, and is cut off so those rows aren't
+    written twice (and no torn line is left behind).
+    """
+
+    def __init__(self, folder, position=None, shard_rows=SHARD_ROWS):
+        self.folder = folder
+        self.shard_rows = shard_rows
+        self.shard, self.rows, self.size = position or (0, 0, 0)
+
+        os.makedirs(folder, exist_ok=True)
+
+        for file in shard_files(folder):
+            number = shard_number(file)
+
+            if number > self.shard:
+                os.remove(file)
+            elif number == self.shard and os.path.getsize(file) > self.size:
+                os.truncate(file, self.size)
+
+    @property
+    def position(self):
+        return [self.shard, self.rows, self.size]
+
+    def write(self, lines):
+        while lines:
+            if self.rows >= self.shard_rows:
+                self.shard += 1
+                self.rows = 0
+                self.size = 0
+
+            chunk, lines = (
+                lines[: self.shard_rows - self.rows],
+                lines[self.shard_rows - self.rows :],
+            )
+
+            with open(f"{self.folder}/{self.shard:05}.jsonl", "ab") as f:
+                f.writelines(chunk)
+                self.size = f.tell()
+
+            self.rows += len(chunk)
+
+
+async def fetch_data(batch_size=FETCH_BATCH):
+    start = time.perf_counter()
+
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+
+    state = load_state(CORPUS_DIR)
+    writers = {
+        label: ShardWriter(f"{CORPUS_DIR}/{label}", state["shards"].get(label, None))
+        for label in LABELS
+    }
 
-async def fetch_data():
     db = await asyncpg.connect(DB_BIND)
-    rs = await db.fetch("SELECT * FROM corpus WHERE truth IN (0, 1)")
 
-    for r in rs:
-        _id = r.get("id")
+    count = 0
+    writing = None
+    written_id = state["last_id"]
+
+    async def wait_for_writes():
+        await writing
+
+        # only recorded once the shards hold everything up to here
+        state["last_id"] = written_id
+        state["shards"] = {label: writer.position for label, writer in writers.items()}
+        await asyncio.to_thread(save_state, CORPUS_DIR, state)
+
+    try:
+        # server side cursor, so neither side holds more than a couple of batches. rows
+        # come in id order so everything up to the last exported id is in the shards. that
+        # does mean a row only labeled after a newer one was exported is never picked up
+        async with db.transaction(readonly=True):
+            cursor = await db.cursor(
+                "SELECT id, truth, data FROM corpus WHERE truth IN (0, 1) AND id > $1 ORDER BY id",
+                state["last_id"],
+            )
+
+            while rows := await cursor.fetch(batch_size):
+                lines = {label: [] for label in LABELS}
+
+                for r in rows:
+                    label = "1" if r.get("truth") else "0"
+                    record = dict(id=r.get("id"), text=" ".join(r.get("data")))
+                    lines[label].append((json.dumps(record) + "\n").encode())
 
-        if not os.path.isdir(CORPUS_DIR):
-            os.mkdir(CORPUS_DIR)
+                # each label's shards are written in their own thread, while the next batch
+                # is fetched. only one batch is in flight so shards stay in order
+                if writing is not None:
+                    await wait_for_writes()
 
-        label = "1" if r.get("truth") else "0"
-        path = f"{CORPUS_DIR}/{label}"
+                writing = asyncio.gather(
+                    *(asyncio.to_thread(writers[label].write, l) for label, l in lines.items())
+                )
+                written_id = rows[-1].get("id")
+                count += len(rows)
 
-        if not os.path.isdir(path):
-            os.mkdir(path)
+            if writing is not None:
+                await wait_for_writes()
+    finally:
+        await db.close()
 
-        file_path = f"{path}/{_id}.txt"
-        # if not os.path.isfile(file_path):
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(" ".join(r.get("data")))
+    elapsed = time.perf_counter() - start
+    print(f"Exported {count} new rows in {elapsed:.1f}s ({count / elapsed:.0f} rows/s)")
 
 
 if __name__ == "__main__":
@@ -1,8 +1,16 @@
+import hashlib
+import json
+import math
 import os
+import random
+import time
 
+import numpy as np
 import torch
 import torch.nn.functional as F
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
+
+TOKENS_DIR = "tokens"
 
 
 def pad(tokens, seq_len, value=0):
@@ -18,41 +26,124 @@ def pad(tokens, seq_len, value=0):
     return F.pad(input=tokens, pad=(0, seq_len - orig_len), value=value)
 
 
-class TextDataset(Dataset):
-    def __init__(self, folder, processor):
-        self.texts = list()
-        self.labels = list()
-        self.tokenized = dict()
+def corpus_files(folder):
+    files = []
 
-        self.processor = processor
+    for dir, subdir, names in os.walk(folder):
+        dir = dir.replace(r"\\", "/")
+        # anything else (like data_fetcher.py's export state) isn't part of the corpus
+        files.extend(f"{dir}/{name}" for name in names if name.endswith((".jsonl", ".txt")))
 
-        # load corpus into .texts and .labels
-        for dir, subdir, files in os.walk(folder):
-            dir = dir.replace(r"\\", "/")
+    return sorted(files)
 
-            for file in files:
-                with open(f"{dir}/{file}", "r", encoding="utf-8") as f:
-                    text = f.read()
 
-                if not len(text):
-                    continue
+def read_texts(file):
+    # shards written by data_fetcher.py hold a json record per line, older exports a text per file
+    with open(file, "r", encoding="utf-8") as f:
+        if file.endswith(".jsonl"):
+            # a torn last line is left by an interrupted export, the next one cuts it off
+            return [json.loads(line)["text"] for line in f if line.endswith("\n")]
 
-                self.texts.append(text)
+        return [f.read()]
 
-                label = int(dir[-1])
-                self.labels.append(label)
 
-    def get_tokens(self, item):
-        tokens = self.tokenized.get(item, None)
+def cache_key(files, processor):
+    # anything that changes the token ids invalidates the cache
+    key = hashlib.sha1()
+    key.update(repr((len(processor.wti), processor.min_len, processor.do_standardize)).encode())
 
-        if tokens is None:
-            tokens = self.processor.process(self.texts[item])
-            self.tokenized[item] = tokens
+    # the vocabulary itself too, rebuilt embeddings can give the same words different ids
+    key.update(processor.wti.words.dtype.str.encode())
+    key.update(np.ascontiguousarray(processor.wti.words).data)
+    key.update(np.ascontiguousarray(processor.wti.ids).data)
+
+    for file in files:
+        stat = os.stat(file)
+        key.update(f"{file}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+
+    return key.hexdigest()
+
+
+def build_token_cache(folder, processor, cache_dir=TOKENS_DIR, batch_size=1024):
+    """Tokenizes the corpus into cache_dir, unless it's already there and up to date.
+
+    The cache is a flat int32 array with the token ids of every text back to back, an
+    offsets array where text i is tokens[offsets[i]:offsets[i + 1]], and the labels.
+    """
+
+    files = corpus_files(folder)
+    key = cache_key(files, processor)
+
+    try:
+        with open(f"{cache_dir}/key") as f:
+            if f.read() == key:
+                return
+    except FileNotFoundError:
+        pass
+
+    start = time.perf_counter()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    texts = []
+    labels = []
+
+    for file in files:
+        label = int(os.path.dirname(file)[-1])
+
+        for text in read_texts(file):
+            if not len(text):
+                continue
+
+            texts.append(text)
+            labels.append(label)
+
+    chunks = []
+    lengths = []
+
+    # tokenize a batch at a time, unpadded so a single long text doesn't blow up the batch
+    for idx in range(0, len(texts), batch_size):
+        tokens, batch_lengths = processor.process_flat(texts[idx : idx + batch_size])
+
+        chunks.append(tokens)
+        lengths.append(batch_lengths)
+
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(lengths or [[]]), out=offsets[1:])
+
+    np.save(f"{cache_dir}/tokens.npy", np.concatenate(chunks or [[]]).astype(np.int32))
+    np.save(f"{cache_dir}/offsets.npy", offsets)
+    np.save(f"{cache_dir}/labels.npy", np.array(labels, dtype=np.int64))
+
+    # written last, so an interrupted build doesn't look valid
+    with open(f"{cache_dir}/key", "w") as f:
+        f.write(key)
+
+    print(f"Tokenized {len(texts)} texts in {time.perf_counter() - start:.1f}s")
 
-        return tokens
+
+class TextDataset(Dataset):
+    """Memory mapped corpus made by build_token_cache()."""
+
+    def __init__(self, cache_dir=TOKENS_DIR):
+        self.tokens = np.load(f"{cache_dir}/tokens.npy", mmap_mode="r")
+        self.offsets = np.load(f"{cache_dir}/offsets.npy")
+        self.labels = np.load(f"{cache_dir}/labels.npy")
+
+    @classmethod
+    def from_corpus(cls, folder, processor, cache_dir=TOKENS_DIR):
+        build_token_cache(folder, processor, cache_dir)
+        return cls(cache_dir)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def get_tokens(self, item):
+        tokens = self.tokens[self.offsets[item] : self.offsets[item + 1]]
+        return torch.from_numpy(tokens.astype(np.int64))
 
     def __len__(self):
-        return len(self.texts)
+        return len(self.labels)
 
     def __getitem__(self, item):
         # get a data point from the loader
@@ -67,17 +158,71 @@ class TextDataset(Dataset):
         return tokens, torch.tensor(label, dtype=torch.float32)
 
 
+class BucketBatchSampler(Sampler):
+    """Batches indices from another sampler so that texts of similar length end up together.
+
+    Indices are drawn from the sampler (e.g. a WeightedRandomSampler, so class balancing
+    still applies) a pool at a time, sorted by length within the pool and cut into batches,
+    which are then shuffled so batch lengths don't just go up and down the pool.
+    """
+
+    def __init__(self, sampler, lengths, batch_size, pool_batches=50, shuffle=True):
+        self.sampler = sampler
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.pool_size = batch_size * pool_batches
+        self.shuffle = shuffle
+
+    def _batches(self, pool):
+        pool = np.asarray(pool)
+        pool = pool[np.argsort(self.lengths[pool], kind="stable")]
+
+        batches = [
+            pool[idx : idx + self.batch_size].tolist()
+            for idx in range(0, len(pool), self.batch_size)
+        ]
+
+        if self.shuffle:
+            random.shuffle(batches)
+
+        return batches
+
+    def __iter__(self):
+        pool = []
+
+        for idx in self.sampler:
+            pool.append(idx)
+
+            if len(pool) == self.pool_size:
+                yield from self._batches(pool)
+                pool = []
+
+        if pool:
+            yield from self._batches(pool)
+
+    def __len__(self):
+        # only the last pool can have a partial batch
+        full_pools, rest = divmod(len(self.sampler), self.pool_size)
+        return full_pools * (self.pool_size // self.batch_size) + math.ceil(rest / self.batch_size)
+
+
 class Sequencer:
-    def __init__(self, sequence_len):
+    def __init__(self, sequence_len, dynamic=False):
         self.sequence_len = sequence_len
+        # pad to the longest text in the batch instead, still capped at sequence_len
+        self.dynamic = dynamic
 
     def __call__(self, batch):
         # sort the batch from longest to shortest sentences
         # not necessarily necessary for convnet but is for LSTM layer with padding and packing
         # batch = sorted(batch, key=lambda x: x[0].size(), reverse=True)
 
+        seq_len = self.sequence_len
+        if self.dynamic:
+            seq_len = min(seq_len, max(token_list.size(0) for token_list, _ in batch))
+
         # and pad and stack into a LongTensor
-        tokens = torch.stack([pad(token_list, self.sequence_len) for token_list, _ in batch])
+        tokens = torch.stack([pad(token_list, seq_len) for token_list, _ in batch])
 
         # strip labels
         labels = torch.tensor([label for _, label in batch], dtype=torch.float32)
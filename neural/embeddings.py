@@ -0,0 +1,99 @@
+import warnings
+
+import numpy as np
+import torch
+
+# longer words get dropped from vocabularies, which keeps the fixed width word array small
+MAX_WORD_BYTES = 64
+
+
+def save_vectors(folder, vectors):
+    np.save(f"{folder}/vectors.npy", np.asarray(vectors, dtype=np.float32))
+
+
+def load_vectors(folder, mmap=True) -> torch.Tensor:
+    """Loads the embedding matrix. Memory mapped vectors are read only, and shared
+    between every process that maps them. Pass mmap=False for a private, writable copy."""
+
+    vectors = np.load(f"{folder}/vectors.npy", mmap_mode="r" if mmap else None)
+
+    with warnings.catch_warnings():
+        # torch complains about read only arrays, which is exactly what we want here
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.from_numpy(vectors)
+
+
+class Vocab:
+    """Word to index map stored as a sorted array of fixed width byte strings.
+
+    Lookups are binary searches over the (memory mapped) array, and can be done for a whole
+    list of tokens at once with lookup().
+    """
+
+    def __init__(self, words: np.ndarray, ids: np.ndarray):
+        self.words = words
+        self.ids = ids
+
+    @classmethod
+    def from_dict(cls, wti: dict):
+        encoded = sorted(
+            (word.encode(), idx)
+            for word, idx in wti.items()
+            if len(word.encode()) <= MAX_WORD_BYTES
+        )
+
+        width = max((len(word) for word, _ in encoded), default=1)
+        words = np.array([word for word, _ in encoded], dtype=f"S{width}")
+        ids = np.array([idx for _, idx in encoded], dtype=np.int64)
+
+        return cls(words, ids)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(f"{folder}/vocab.npy", mmap_mode=mmap_mode),
+            np.load(f"{folder}/vocab_ids.npy", mmap_mode=mmap_mode),
+        )
+
+    def save(self, folder):
+        np.save(f"{folder}/vocab.npy", self.words)
+        np.save(f"{folder}/vocab_ids.npy", self.ids)
+
+    def lookup(self, tokens, default=-1) -> np.ndarray:
+        """Returns an int64 array with the index of every token, or default if not found."""
+
+        if not len(tokens) or not len(self.words):
+            return np.full(len(tokens), default, dtype=np.int64)
+
+        encoded = [token.encode() for token in tokens]
+        width = self.words.dtype.itemsize
+
+        # longer tokens would get truncated by numpy and could match a shorter word
+        fits = np.fromiter((len(token) <= width for token in encoded), bool, len(encoded))
+        queries = np.array(encoded, dtype=self.words.dtype)
+
+        pos = np.searchsorted(self.words, queries).clip(max=len(self.words) - 1)
+        found = fits & (self.words[pos] == queries)
+
+        return np.where(found, self.ids[pos], default)
+
+    def get(self, word, default=None):
+        idx = self.lookup([word], default=-1)[0]
+        return default if idx == -1 else int(idx)
+
+    def __getitem__(self, word):
+        idx = self.get(word, None)
+        if idx is None:
+            raise KeyError(word)
+        return idx
+
+    def __contains__(self, word):
+        return self.get(word, None) is not None
+
+    def __len__(self):
+        return len(self.words)
+
+    def items(self):
+        for word, idx in zip(self.words, self.ids):
+            yield word.decode(), int(idx)
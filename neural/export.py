@@ -0,0 +1,67 @@
+import sys
+
+import torch
+from torch import nn
+from torch.ao.quantization import (
+    default_dynamic_qconfig,
+    float_qparams_weight_only_qconfig,
+    quantize_dynamic,
+)
+
+from model import TextCNN
+
+ARTIFACT = "model.pt"
+
+
+def load_eager(state_path="model.pth"):
+    # the state dict is memory mapped and assigned to the model as is, so the weights
+    # (mostly the embedding matrix) are shared by every process serving the same file
+    state = torch.load(state_path, map_location=torch.device("cpu"), mmap=True)
+
+    with torch.device("meta"):
+        model = TextCNN(
+            embeddings=torch.empty_like(state["embedding.weight"], device="meta"),
+            n_filters=64,
+            filter_sizes=[2, 3],
+            dropout=0.0,
+        )
+
+    model.load_state_dict(state, assign=True)
+    model.eval()
+
+    return model
+
+
+def export(model: TextCNN):
+    # dynamic quantization only covers linear layers (the convs stay float32), and the
+    # embedding matrix, which is most of the parameters, gets 8 bit weight only quantization
+    quantized = quantize_dynamic(
+        model,
+        qconfig_spec={
+            nn.Linear: default_dynamic_qconfig,
+            nn.Embedding: float_qparams_weight_only_qconfig,
+        },
+        dtype=torch.qint8,
+    )
+
+    scripted = torch.jit.script(quantized)
+    return torch.jit.freeze(scripted)
+
+
+def main(state_path="model.pth", artifact=ARTIFACT):
+    model = load_eager(state_path)
+    scripted = export(model)
+
+    # sanity check that the exported model roughly agrees with the eager one
+    x = torch.randint(0, model.embedding.num_embeddings, (8, 64))
+    with torch.inference_mode():
+        diff = (model(x) - scripted(x)).abs().max().item()
+
+    print("Max difference to eager model on random input:", diff)
+
+    torch.jit.save(scripted, artifact)
+    print("Saved", artifact)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -1,8 +1,8 @@
 import os
-import pickle
 from collections import Counter
 
-import torch
+from dataset import corpus_files, read_texts
+from embeddings import Vocab, load_vectors, save_vectors
 from torch_config import CORPUS_DIR, EMBEDDINGS_DIR, GLOVE_DIR
 from torchtext.data.utils import get_tokenizer
 from tqdm import tqdm
@@ -10,39 +10,26 @@ from tqdm import tqdm
 tokenizer = get_tokenizer("basic_english")
 counter = Counter()
 
-for dir, subdir, files in os.walk(CORPUS_DIR):
-    dir = dir.replace(r"\\", "/")
-
-    print("\nReading:", dir)
-    for file in tqdm(files):
-        with open(f"{dir}/{file}", "r", encoding="utf-8") as f:
-            text = f.read()
-
+print("Reading:", CORPUS_DIR)
+for file in tqdm(corpus_files(CORPUS_DIR)):
+    for text in read_texts(file):
         if not len(text):
             continue
 
         counter.update(tokenizer(text))
 
-glove_wti: dict = pickle.load(open(f"{GLOVE_DIR}/word2idx.pkl", "rb"))
-glove_vectors: torch.Tensor = torch.load(f"{GLOVE_DIR}/vectors.pkl")
-
-embed_idx = 0
-embed_wti = dict()
-embed_vectors = []
+glove_vocab = Vocab.load(GLOVE_DIR)
+glove_vectors = load_vectors(GLOVE_DIR).numpy()
 
 print("Copying relevant embeddings...")
-for word in counter.keys():
-    glove_idx = glove_wti.get(word, None)
-
-    if glove_idx is None:
-        continue
+words = list(counter.keys())
+glove_idx = glove_vocab.lookup(words)
+found = glove_idx != -1
 
-    embed_wti[word] = embed_idx
-    embed_vectors.append(glove_vectors[glove_idx])
-    embed_idx += 1
+embed_wti = {word: idx for idx, word in enumerate(w for w, f in zip(words, found) if f)}
 
 if not os.path.exists(EMBEDDINGS_DIR):
     os.mkdir(EMBEDDINGS_DIR)
 
-pickle.dump(embed_wti, open(f"{EMBEDDINGS_DIR}/wti.pkl", "wb"))
-torch.save(torch.stack(embed_vectors), f"{EMBEDDINGS_DIR}/vectors.pkl")
+Vocab.from_dict(embed_wti).save(EMBEDDINGS_DIR)
+save_vectors(EMBEDDINGS_DIR, glove_vectors[glove_idx[found]])
@@ -41,3 +41,26 @@ class TextCNN(nn.Module):
 
         x = self.fc(x)
         return self.sigmoid(x)
+
+
+def predict_by_length(model, token_lists):
+    """Predicts a list of 1d token tensors, running the ones of the same length together.
+
+    Padding them to a common length would change the result, the max pool runs over the
+    padding too and index 0 is a real word, so this gives every text the same prediction
+    it would get on its own.
+    """
+
+    groups = dict()  # length: [idx]
+    for idx, tokens in enumerate(token_lists):
+        groups.setdefault(len(tokens), []).append(idx)
+
+    preds = [None] * len(token_lists)
+
+    for idxs in groups.values():
+        x = torch.stack([token_lists[idx] for idx in idxs])
+
+        for idx, pred in zip(idxs, model(x).squeeze(1).tolist()):
+            preds[idx] = pred
+
+    return preds
@@ -1,29 +1,137 @@
-import pickle
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-import torch
+import numpy as np
+from embeddings import Vocab, save_vectors
 from torch_config import GLOVE_DIR
 from tqdm import tqdm
 
-idx = 0
-word2idx = {}
-glove_size = 1193517
-vectors = torch.empty((glove_size, 100), dtype=torch.float32)
+GLOVE_FILE = f"{GLOVE_DIR}/glove.twitter.27B.100d.txt"
+BLOCK_SIZE = 16 * 1024 * 1024
+WORKERS = os.cpu_count() or 1
 
-with open(f"{GLOVE_DIR}/glove.twitter.27B.100d.txt", "rb") as f:
-    for l in tqdm(f, total=glove_size):
-        line = l.decode().split()
 
-        if len(line) != 101:
+def read_blocks(f, size=BLOCK_SIZE):
+    # yields chunks of whole lines, the partial line at the end of a read carries over
+    rest = b""
+
+    while block := f.read(size):
+        block = rest + block
+        end = block.rfind(b"\n") + 1
+
+        if end:
+            rest = block[end:]
+            yield block[:end]
+        else:
+            rest = block
+
+    if rest:
+        yield rest
+
+
+def scan(path):
+    """Counts lines and gets the vector dimension from the first line, without parsing."""
+
+    lines = 0
+    dim = None
+
+    with open(path, "rb") as f:
+        for block in read_blocks(f):
+            if dim is None:
+                dim = len(block.split(b"\n", 1)[0].decode().split()) - 1
+            lines += block.count(b"\n") + (not block.endswith(b"\n"))
+
+    return lines, dim
+
+
+def parse_block(block, dim):
+    words = []
+    values = []
+
+    for line in block.decode().split("\n"):
+        parts = line.rstrip().split(maxsplit=1)
+
+        # skip malformed lines (words with spaces in them, mostly)
+        if len(parts) != 2 or parts[1].count(" ") != dim - 1:
             continue
 
-        word = line[0]
-        word2idx[word] = idx
+        words.append(parts[0])
+        values.append(parts[1])
+
+    if not values:
+        return words, np.empty((0, dim), dtype=np.float32)
+
+    # one C level parse for the whole block instead of a float() per value
+    return words, np.loadtxt(values, dtype=np.float32, comments=None, ndmin=2)
+
+
+def parse_blocks(f, dim, workers=WORKERS):
+    """Yields (block size, words, vectors) in file order, parsing blocks in parallel.
+
+    Only a few blocks are in flight at a time, so memory stays bounded by the block size.
+    """
+
+    if workers <= 1:
+        for block in read_blocks(f):
+            yield len(block), *parse_block(block, dim)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        for block in read_blocks(f):
+            pending.append((len(block), pool.submit(parse_block, block, dim)))
+
+            if len(pending) > workers * 2:
+                size, fut = pending.popleft()
+                yield size, *fut.result()
+
+        while pending:
+            size, fut = pending.popleft()
+            yield size, *fut.result()
+
+
+def main():
+    start = time.perf_counter()
+
+    rows, dim = scan(GLOVE_FILE)
+    print(f"{rows} rows, {dim} dimensions")
+
+    # rows is an upper bound, we only need a compacted copy if some lines were skipped
+    tmp_path = f"{GLOVE_DIR}/vectors.npy.tmp"
+    vectors = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(rows, dim))
+
+    idx = 0
+    word2idx = {}
+
+    with open(GLOVE_FILE, "rb") as f:
+        with tqdm(total=os.path.getsize(GLOVE_FILE), unit="B", unit_scale=True) as progress:
+            for size, words, block_vectors in parse_blocks(f, dim):
+                vectors[idx : idx + len(words)] = block_vectors
+                for offset, word in enumerate(words):
+                    word2idx[word] = idx + offset
+
+                idx += len(words)
+                progress.update(size)
+
+    vectors.flush()
+
+    if idx == rows:
+        del vectors
+        os.replace(tmp_path, f"{GLOVE_DIR}/vectors.npy")
+    else:
+        print(f"Skipped {rows - idx} malformed lines")
+        save_vectors(GLOVE_DIR, vectors[:idx])
+        del vectors
+        os.remove(tmp_path)
+
+    Vocab.from_dict(word2idx).save(GLOVE_DIR)
 
-        c = line[1:]
-        vector = torch.tensor([float(x) for x in c], dtype=torch.float32)
-        vectors[idx] = vector
+    elapsed = time.perf_counter() - start
+    print(f"Processed {idx} vectors in {elapsed:.1f}s ({idx / elapsed:.0f} rows/s)")
 
-        idx += 1
 
-pickle.dump(word2idx, open(f"{GLOVE_DIR}/word2idx.pkl", "wb"))
-torch.save(vectors, f"{GLOVE_DIR}/vectors.pkl")
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
 import re
 import string
+from functools import lru_cache
 
+import numpy as np
 import torch
-import torch.nn.functional as F
 from unidecode import unidecode
 
+URL_RE = re.compile(r"^https?:\/\/.*[\r\n]*", flags=re.MULTILINE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+# numbers, dots and commas become spaces, the rest of the punctuation is dropped
+STRIP_TABLE = str.maketrans(
+    {
+        **{c: None for c in string.punctuation},
+        **{c: " " for c in string.digits + ".,"},
+    }
+)
+
+STANDARDIZE_CACHE = 4096
+
 
 class TextProcessor:
     def __init__(self, wti, tokenizer, standardize=True, min_len=None):
@@ -15,36 +29,75 @@ class TextProcessor:
 
     def process(self, text):
         # converts a string to a list of word indices, using the tokenizer and "word to index" map
-        text = self.standardize(text) if self.do_standardize else text
-        tensor = torch.LongTensor([self.wti.get(word, 1) for word in self.tokenizer(text)])
+        tokens, _ = self.process_batch([text])
+        return tokens[0]
+
+    def process_batch(self, texts, max_len=None):
+        """Converts a list of strings to a LongTensor of word indices padded with 0, and
+        a LongTensor with the length of every row.
+
+        Texts shorter than min_len are padded with UNK up to it (and that counts towards
+        their length), longer than max_len ones are cut off.
+        """
+
+        ids, lengths = self.process_flat(texts, max_len=max_len)
+        positions = np.arange(lengths.max(initial=0))
+
+        out = np.zeros((len(texts), len(positions)), dtype=np.int64)
+        out[positions < lengths[:, None]] = ids
+
+        return torch.from_numpy(out), torch.from_numpy(lengths)
+
+    def process_flat(self, texts, max_len=None):
+        """Like process_batch, but without the padding to a common length. Returns an int64
+        array with the word indices of every text back to back, and the length of each."""
 
-        if self.min_len is not None:
-            tensor_len = tensor.size(0)
-            if tensor_len < self.min_len:
-                tensor = F.pad(
-                    input=tensor, pad=(0, self.min_len - tensor_len), value=1
-                )  # we need to pad with UNK
+        token_lists = [
+            self.tokenizer(self.standardize(text) if self.do_standardize else text)
+            for text in texts
+        ]
 
-        return tensor
+        lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+
+        # a single vocabulary lookup for the whole batch
+        ids = self.wti.lookup([token for tokens in token_lists for token in tokens], default=1)
+
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        within = np.arange(len(ids)) - starts  # position of every id in its text
+
+        if max_len is not None and lengths.max(initial=0) > max_len:
+            keep = within < max_len
+            ids, within = ids[keep], within[keep]
+            lengths = lengths.clip(max=max_len)
+
+        if self.min_len is None or lengths.min(initial=self.min_len) >= self.min_len:
+            return ids, lengths
+
+        # texts shorter than min_len are padded with UNK
+        padded_lengths = lengths.clip(min=self.min_len)
+        padded_starts = np.cumsum(padded_lengths) - padded_lengths
+
+        out = np.ones(padded_lengths.sum(), dtype=np.int64)
+        out[np.repeat(padded_starts, lengths) + within] = ids
+
+        return out, padded_lengths
 
     @staticmethod
+    @lru_cache(maxsize=STANDARDIZE_CACHE)
     def standardize(s: str):
         # make lowercase
         s = s.lower()
 
         # remove urls
-        s = re.sub(r"^https?:\/\/.*[\r\n]*", "", s, flags=re.MULTILINE)
+        s = URL_RE.sub("", s)
 
         # remove diacritics
         s = unidecode(s)
 
-        # remove numbers
-        s = re.sub(f"[{string.digits}\.,]", " ", s)
-
-        # remove punctuation
-        s = re.sub(f"[{re.escape(string.punctuation)}]", "", s)
+        # remove numbers and punctuation
+        s = s.translate(STRIP_TABLE)
 
         # condense whitespaces
-        s = re.sub(r"\s+", " ", s)
+        s = WHITESPACE_RE.sub(" ", s)
 
         return s.lower().strip()
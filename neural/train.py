@@ -1,12 +1,15 @@
+import argparse
 import glob
 import os
-import pickle
+import time
 
+import numpy as np
 import torch
-from dataset import Sequencer, TextDataset
+from dataset import BucketBatchSampler, Sequencer, TextDataset
+from embeddings import Vocab, load_vectors
 from text_processor import TextProcessor
 from torch import nn
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, SequentialSampler
 from torch_config import CORPUS_DIR, EMBEDDINGS_DIR
 from torchtext.data.utils import get_tokenizer
 from tqdm import tqdm
@@ -15,21 +18,47 @@ from model import TextCNN
 
 DATA_SPLIT = 0.75
 SEQUENCE_LEN = 380
+BATCH_SIZE = 32
+LOADER_WORKERS = min(4, os.cpu_count() or 1)
 
 
-def main():
-    device = torch.device("cuda")
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu", type=torch.device
+    )
+    parser.add_argument("--threads", type=int, help="intra-op threads, defaults to torch's")
+    parser.add_argument("--interop-threads", type=int, help="inter-op threads")
+    parser.add_argument("--bf16", action="store_true", help="autocast to bfloat16")
+    parser.add_argument("--accumulate", type=int, default=1, help="batches per optimizer step")
+    return parser.parse_args()
+
+
+def main(args):
+    device = args.device
+
+    # has to happen before any parallel work
+    if args.interop_threads:
+        torch.set_num_interop_threads(args.interop_threads)
+    if args.threads:
+        torch.set_num_threads(args.threads)
 
-    embedding_vectors = torch.load(f"{EMBEDDINGS_DIR}/vectors.pkl")
+    print(f"Training on {device}, {torch.get_num_threads()} threads, bf16: {args.bf16}")
+
+    def autocast():
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=args.bf16)
+
+    # private copy, since the embeddings get fine tuned
+    embedding_vectors = load_vectors(EMBEDDINGS_DIR, mmap=False)
 
     text_processor = TextProcessor(
-        wti=pickle.load(open(f"{EMBEDDINGS_DIR}/wti.pkl", "rb")),
+        wti=Vocab.load(EMBEDDINGS_DIR),
         tokenizer=get_tokenizer("basic_english"),
         standardize=True,
         min_len=3,
     )
 
-    dataset = TextDataset(CORPUS_DIR, text_processor)
+    dataset = TextDataset.from_corpus(CORPUS_DIR, text_processor)
 
     # split into training and test set
     # TODO: fix this splitting sometimes failing when corpus size changes
@@ -38,35 +67,34 @@ def main():
         [int(len(dataset) * DATA_SPLIT), int(len(dataset) * (1.0 - DATA_SPLIT))],
     )
 
-    # count number of samples in each class
-    class_count = [0, 0]
-    for data, label in dataset:
-        class_count[int(label.item())] += 1
-
-    # get relative weights for classes
-    _sum = sum(class_count)
-    class_count[0] /= _sum
-    class_count[1] /= _sum
-
-    # reverse the weights since we're getting the inverse for the sampler
-    class_count = list(reversed(class_count))
+    # relative size of each class, reversed since we're getting the inverse for the sampler
+    class_count = np.bincount(dataset.labels, minlength=2)
+    class_weights = (class_count / class_count.sum())[::-1]
 
     # set weight for every sample
-    weights = [class_count[int(x[1].item())] for x in train_set]
+    weights = class_weights[dataset.labels[train_set.indices]].tolist()
 
     # weighted sampler
     sampler = torch.utils.data.WeightedRandomSampler(
         weights=weights, num_samples=len(train_set), replacement=True
     )
 
-    train_loader = DataLoader(
-        dataset=train_set,
-        batch_size=32,
-        collate_fn=Sequencer(SEQUENCE_LEN),
-        sampler=sampler,
+    # batches of similar length texts, padded to the longest one in the batch
+    lengths = dataset.lengths
+    train_batches = BucketBatchSampler(sampler, lengths[train_set.indices], BATCH_SIZE)
+    test_batches = BucketBatchSampler(
+        SequentialSampler(test_set), lengths[test_set.indices], BATCH_SIZE, shuffle=False
     )
 
-    test_loader = DataLoader(dataset=test_set, batch_size=32, collate_fn=Sequencer(SEQUENCE_LEN))
+    loader_kwargs = dict(
+        collate_fn=Sequencer(SEQUENCE_LEN, dynamic=True),
+        num_workers=LOADER_WORKERS,
+        pin_memory=device.type == "cuda",
+        persistent_workers=LOADER_WORKERS > 0,
+    )
+
+    train_loader = DataLoader(dataset=train_set, batch_sampler=train_batches, **loader_kwargs)
+    test_loader = DataLoader(dataset=test_set, batch_sampler=test_batches, **loader_kwargs)
 
     # number of filters in each convolutional filter
     N_FILTERS = 64
@@ -101,24 +129,40 @@ def main():
     for epoch in range(EPOCHS):
         print("Epoch", epoch + 1)
 
+        samples = 0
+        start = time.perf_counter()
+
+        optimizer.zero_grad()
+
         for i, data in tqdm(enumerate(train_loader), total=len(train_loader)):
             # get word indices vector and corresponding labels
             x, labels = data
 
             # send to device
-            x = x.to(device)
-            labels = labels.to(device)
+            x = x.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
 
             # make predictions
-            predictions = model(x).squeeze()
+            with autocast():
+                predictions = model(x).squeeze(1)
 
-            # calculate loss
-            loss = criterion(predictions, labels)
+            # calculate loss, in float32 since BCELoss can't be autocast
+            loss = criterion(predictions.float(), labels) / args.accumulate
 
             # learning stuff...
-            optimizer.zero_grad()
             loss.backward()
-            optimizer.step()
+
+            if (i + 1) % args.accumulate == 0 or i + 1 == len(train_loader):
+                optimizer.step()
+                optimizer.zero_grad()
+
+            samples += x.size(0)
+
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+        epoch_time = time.perf_counter() - start
+        print(f"Epoch time: {epoch_time:.1f}s, {samples / epoch_time:.0f} samples/s")
 
         # evaluate
         with torch.no_grad():
@@ -132,7 +176,8 @@ def main():
                 x, label = data
                 x = x.to(device)
 
-                predictions = model(x).squeeze()
+                with autocast():
+                    predictions = model(x).squeeze(1).float()
 
                 for truth, prediction in zip(label, predictions):
                     y = int(truth.item())
@@ -168,12 +213,11 @@ def main():
     with torch.no_grad():
         while True:
             text = input("Prompt: ")
-            x = text_processor.process(text)
-            x = torch.tensor(x).unsqueeze(dim=0)
+            x, _ = text_processor.process_batch([text])
             print(model(x.to(device)).squeeze())
 
 
 if __name__ == "__main__":
     if not os.path.isdir("models"):
         os.mkdir("models")
-    main()
+    main(parse_args())
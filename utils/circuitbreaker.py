@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stops calling a service that keeps failing.
+
+    After `threshold` consecutive failures (exceptions or timeouts) the circuit opens and
+    calls fail right away with CircuitOpen. Once `reset_after` seconds have passed a single
+    probe call is let through (half-open), which either closes the circuit again or keeps it
+    open for another `reset_after` seconds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, threshold=5, reset_after=30.0, timeout=3.0, exceptions=(Exception,)):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.timeout = timeout
+        self.exceptions = tuple(exceptions) + (asyncio.TimeoutError,)
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=500)
+
+    def _allow(self):
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+            self.state = self.HALF_OPEN
+
+        # only one probe at a time while half-open
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+
+        return False
+
+    def _open(self):
+        if self.state != self.OPEN:
+            log.warning("Circuit %s opened after %s failures", self.name, self.failures)
+
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+    async def call(self, func, *args, **kwargs):
+        if not self._allow():
+            self.rejected += 1
+            raise CircuitOpen(self.name)
+
+        self.calls += 1
+        start = time.perf_counter()
+
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), self.timeout)
+        except self.exceptions:
+            self.errors += 1
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self._open()
+
+            raise
+        else:
+            if self.state != self.CLOSED:
+                log.info("Circuit %s closed", self.name)
+
+            self.state = self.CLOSED
+            self.failures = 0
+
+            return result
+        finally:
+            self._probing = False
+            self.latencies.append(time.perf_counter() - start)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    def stats(self):
+        return dict(
+            state=self.state,
+            calls=self.calls,
+            errors=self.errors,
+            rejected=self.rejected,
+            p50=self.percentile(0.5),
+            p99=self.percentile(0.99),
+        )
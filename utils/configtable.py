@@ -1,56 +1,101 @@
 import asyncio
+import json
 import logging
+import time
+import uuid
+import weakref
 
 log = logging.getLogger(__name__)
 
+# updates are announced on this channel so other processes can drop their cached copy
+NOTIFY_CHANNEL = "config_update"
+
+# tells our own notifications apart from other processes'
+INSTANCE_ID = uuid.uuid4().hex
+
+_tables = weakref.WeakValueDictionary()  # table name: ConfigTable
+
+
+def on_notification(connection, pid, channel, payload):
+    """asyncpg listener callback for NOTIFY_CHANNEL."""
+
+    data = json.loads(payload)
+
+    if data["origin"] == INSTANCE_ID:
+        return
+
+    config = _tables.get(data["table"], None)
+    if config is not None:
+        config.evict(*data["keys"])
+
+
+async def flush_all():
+    """Writes out every pending write-behind update, for shutdown."""
+
+    for config in list(_tables.values()):
+        await config.flush()
+
+
+def evict_all():
+    """Drops every cached entry, for when notifications might have been missed."""
+
+    for config in list(_tables.values()):
+        config.entries.clear()
+        config._non_existent.clear()
+
 
 class ConfigTableRecord(object):
-    _data = dict()
+    """Base for table records. ConfigTable generates a subclass per table (and record class)
+    with a slot for each column, so reading a column is a plain attribute lookup.
+
+    Subclasses should set __slots__ as well, listing any attributes of their own.
+    """
+
+    __slots__ = ("_config", "_dirty")
+
+    # set on the generated classes
+    _columns = ()
+    _column_bits = dict()  # column: bit in _dirty
 
     def __init__(self, config, record):
-        self._config = config
-        self._data = dict()
-        self._dirty = set()
+        object.__setattr__(self, "_config", config)
+        object.__setattr__(self, "_dirty", 0)
 
         for key, value in record.items():
-            self._data[key] = value
+            object.__setattr__(self, key, value)
 
     def __getattr__(self, key):
-        if key in self._data:
-            return self._data[key]
+        # only called for attributes that don't exist, which have always read as None
+        return None
 
     def __setattr__(self, key, value):
-        if key in self._data:
+        if key in self._column_bits:
             self.set(key, value)
         else:
-            self.__dict__[key] = value
-
-    def _build_dirty(self, start_at=1):
-        return ", ".join(
-            "{} = ${}".format(key, idx + start_at) for idx, key in enumerate(self._dirty)
-        )
+            object.__setattr__(self, key, value)
 
     def _set_dirty(self, key):
-        if key not in self._data:
+        bit = self._column_bits.get(key, None)
+        if bit is None:
             raise AttributeError(
                 "Attempted to set key {} to dirty, but it does not exist".format(key)
             )
-        self._dirty.add(key)
+        object.__setattr__(self, "_dirty", self._dirty | bit)
 
     def _clear_dirty(self):
-        self._dirty.clear()
+        object.__setattr__(self, "_dirty", 0)
 
     def get(self, key):
-        if key in self._data:
-            return self._data[key]
+        if key in self._column_bits:
+            return object.__getattribute__(self, key)
         else:
             raise AttributeError("Key '{}' not defined in this table.".format(key))
 
     def set(self, key, value):
-        if key not in self._data:
+        if key not in self._column_bits:
             raise AttributeError("Key '{}' not defined in this table.".format(key))
 
-        self._data[key] = value
+        object.__setattr__(self, key, value)
         self._set_dirty(key)
 
     async def update(self, **kwargs):
@@ -60,22 +105,36 @@ class ConfigTableRecord(object):
         if not self._dirty:
             raise ValueError("No values dirty for table {}".format(self._config.table))
 
-        query = "UPDATE {} SET {} WHERE {}".format(
-            self._config.table,
-            self._build_dirty(len(self._config.primary) + 1),
-            self._config.build_predicate(),
-        )
-
-        keys = tuple(self._data[primary] for primary in self._config.primary)
-        values = tuple(self._data[key] for key in self._dirty)
+        if self._config.write_behind is None:
+            await self.flush()
+        else:
+            self._config.schedule_flush(self)
 
-        await self._config.bot.db.execute(query, *keys, *values)
+    async def flush(self):
+        dirty = self._dirty
+        if not dirty:
+            return
 
+        # in column order, so the same set of columns always makes the same (prepared) statement
+        columns = tuple(key for key in self._columns if dirty & self._column_bits[key])
         self._clear_dirty()
 
+        keys = tuple(self.get(primary) for primary in self._config.primary)
+        values = tuple(self.get(key) for key in columns)
+        payload = json.dumps(dict(table=self._config.table, keys=keys, origin=INSTANCE_ID))
+
+        try:
+            await self._config.bot.db.execute(
+                self._config.update_query(columns), *keys, *values, NOTIFY_CHANNEL, payload
+            )
+        except BaseException:
+            # keep them dirty so they're written next time
+            object.__setattr__(self, "_dirty", self._dirty | dirty)
+            raise
+
 
 class ConfigTable:
-    def __init__(self, bot, table, primary, record_class=None):
+    def __init__(self, bot, table, primary, record_class=None, write_behind=None):
         record_class = record_class or ConfigTableRecord
 
         if record_class is not ConfigTableRecord and not issubclass(
@@ -94,8 +153,25 @@ class ConfigTable:
         self.entries = dict()
 
         self._record_class = record_class
-        self._lock = asyncio.Lock()
         self._non_existent = set()
+        self._loading = dict()  # keys: future of the in-flight load
+
+        # seconds updates are held back and coalesced for, None writes them right away.
+        # a delayed write that fails is only logged, whoever called record.update() never
+        # hears about it, so only use this where a lost update isn't a big deal
+        self.write_behind = write_behind
+        self._pending = dict()  # record: task flushing it
+        self._update_queries = dict()  # columns: query
+        self._record_types = dict()  # columns: generated record class
+
+        # hits are cache hits, misses went to the database and waits joined someone else's load
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.load_time = 0.0
+
+        # the newest instance wins, cogs construct a new one when reloaded
+        _tables[table] = self
 
         log.debug("Constructed ConfigTable for table %s with keys %s", table, primary)
 
@@ -107,12 +183,104 @@ class ConfigTable:
     def get_keys_from_record(self, record):
         return tuple(record.get(primary) for primary in self.primary)
 
+    @property
+    def _get_query(self):
+        return "SELECT * FROM {} WHERE {}".format(self.table, self.build_predicate())
+
     @property
     def _insert_query(self):
-        return "INSERT INTO {} ({}) VALUES ({})".format(
+        # returns the new row, or the existing one if it's already there (in one round trip)
+        return (
+            "WITH inserted AS (INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT DO NOTHING "
+            "RETURNING *) SELECT * FROM inserted UNION ALL SELECT * FROM {0} WHERE {3}"
+        ).format(
             self.table,
             ", ".join(self.primary),
             ", ".join("${}".format(idx + 1) for idx, _ in enumerate(self.primary)),
+            self.build_predicate(),
+        )
+
+    def make_record(self, record):
+        columns = tuple(record.keys())
+        record_type = self._record_types.get(columns, None)
+
+        if record_type is None:
+            record_type = type(
+                self._record_class.__name__,
+                (self._record_class,),
+                dict(
+                    __slots__=columns,
+                    _columns=columns,
+                    _column_bits={column: 1 << idx for idx, column in enumerate(columns)},
+                ),
+            )
+
+            self._record_types[columns] = record_type
+
+        return record_type(self, record)
+
+    def update_query(self, columns):
+        query = self._update_queries.get(columns, None)
+
+        if query is None:
+            param = len(self.primary) + len(columns) + 1
+
+            # notifies other processes in the same round trip, if a row was actually updated
+            query = (
+                "WITH updated AS (UPDATE {} SET {} WHERE {} RETURNING 1) "
+                "SELECT pg_notify(${}, ${}) FROM updated"
+            ).format(
+                self.table,
+                ", ".join(
+                    "{} = ${}".format(key, idx + len(self.primary) + 1)
+                    for idx, key in enumerate(columns)
+                ),
+                self.build_predicate(),
+                param,
+                param + 1,
+            )
+
+            self._update_queries[columns] = query
+
+        return query
+
+    def schedule_flush(self, record):
+        if record not in self._pending:
+            self._pending[record] = asyncio.create_task(self._flush_later(record))
+
+    async def _flush_later(self, record):
+        await asyncio.sleep(self.write_behind)
+
+        # no longer pending once we start writing, later updates schedule a new flush
+        del self._pending[record]
+
+        try:
+            await record.flush()
+        except Exception:
+            log.exception("Failed write-behind update of %s for table %s", record, self.table)
+
+    async def flush(self):
+        """Writes out pending write-behind updates right away."""
+
+        pending, self._pending = self._pending, dict()
+
+        for record, task in pending.items():
+            task.cancel()
+
+            # one failing shouldn't keep the rest from being written
+            try:
+                await record.flush()
+            except Exception:
+                log.exception("Failed write-behind update of %s for table %s", record, self.table)
+
+    def stats(self):
+        return dict(
+            table=self.table,
+            entries=len(self.entries),
+            hits=self.hits,
+            misses=self.misses,
+            waits=self.waits,
+            load_time=self.load_time,
         )
 
     async def insert_record(self, record, keys=None):
@@ -123,11 +291,47 @@ class ConfigTable:
 
         log.debug("Inserting record with keys %s for table %s", keys, self.table)
 
-        entry = self._record_class(self, record)
+        entry = self.make_record(record)
         self.entries[keys] = entry
 
         return entry
 
+    async def warm_up(self, guild_ids):
+        """Loads the entries of many guilds in one query. Only for tables keyed on guild_id."""
+
+        if self.primary != ("guild_id",):
+            raise TypeError("Only tables with guild_id as primary key can be warmed up.")
+
+        start = time.perf_counter()
+
+        records = await self.bot.db.fetch(
+            "SELECT * FROM {} WHERE guild_id = ANY($1)".format(self.table), list(guild_ids)
+        )
+
+        found = set()
+
+        for record in records:
+            keys = self.get_keys_from_record(record)
+            found.add(keys)
+
+            # anything loaded on demand in the meantime is at least as fresh
+            if keys not in self.entries and keys not in self._loading:
+                self.entries[keys] = self.make_record(record)
+                self._non_existent.discard(keys)
+
+        for guild_id in guild_ids:
+            keys = (guild_id,)
+            if keys not in found and keys not in self.entries and keys not in self._loading:
+                self._non_existent.add(keys)
+
+        log.info(
+            "Warmed up %s with %s of %s guilds in %.3fs",
+            self.table,
+            len(records),
+            len(guild_ids),
+            time.perf_counter() - start,
+        )
+
     async def get_entry(self, *keys, construct=True):
         keys = tuple(keys)
 
@@ -135,45 +339,101 @@ class ConfigTable:
             if not isinstance(key, int):
                 raise TypeError("Primary key must be int.")
 
-        if not construct and keys in self._non_existent:
-            return None
-
-        async with self._lock:
-            if keys in self.entries:
-                return self.entries[keys]
-
-            get_query = "SELECT * FROM {} WHERE ".format(self.table) + self.build_predicate()
+        while True:
+            # fast path, no locking for cached entries
+            entry = self.entries.get(keys, None)
+            if entry is not None:
+                self.hits += 1
+                return entry
+
+            if not construct and keys in self._non_existent:
+                self.hits += 1
+                return None
+
+            # only one load per key at a time, everyone else waits for its result
+            fut = self._loading.get(keys, None)
+            if fut is None:
+                break
+
+            self.waits += 1
+
+            try:
+                entry = await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # the load was cancelled, not us, so try again
+                if fut.cancelled():
+                    continue
+                raise
+
+            # a load that didn't construct might have come back empty handed, if we
+            # do want the entry constructed we'll have to go again
+            if entry is not None or not construct:
+                return entry
+
+        self.misses += 1
+
+        fut = asyncio.get_running_loop().create_future()
+        self._loading[keys] = fut
+
+        start = time.perf_counter()
+
+        try:
+            entry = await self._load_entry(keys, construct)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as exc:
+            fut.set_exception(exc)
+            # don't warn about it never being retrieved if nobody was waiting
+            fut.exception()
+            raise
+        else:
+            fut.set_result(entry)
+            return entry
+        finally:
+            del self._loading[keys]
+            self.load_time += time.perf_counter() - start
 
-            record = await self.bot.db.fetchrow(get_query, *keys)
+    async def _load_entry(self, keys, construct):
+        if construct:
+            record = await self.bot.db.fetchrow(self._insert_query, *keys)
 
+            # comes back empty if a concurrent insert isn't visible to this statement yet
             if record is None:
-                if not construct:
-                    self._non_existent.add(keys)
-                    return None
-                elif keys in self._non_existent:
-                    self._non_existent.remove(keys)
+                record = await self.bot.db.fetchrow(self._get_query, *keys)
+        else:
+            record = await self.bot.db.fetchrow(self._get_query, *keys)
 
-                await self.bot.db.execute(self._insert_query, *keys)
-                record = await self.bot.db.fetchrow(get_query, *keys)
+        if record is None:
+            if not construct:
+                self._non_existent.add(keys)
+            return None
 
-            return await self.insert_record(record, keys=keys)
+        return await self.insert_record(record, keys=keys)
 
     def has_entry(self, *keys):
         return tuple(keys) in self.entries
 
+    def evict(self, *keys):
+        keys = tuple(keys)
+
+        self._non_existent.discard(keys)
+
+        if self.entries.pop(keys, None) is not None:
+            log.debug("Evicted entry %s for table %s", keys, self.table)
+
     async def clear_entry(self, *keys):
         """Returns True if key(s) found in entries dict."""
 
         keys = tuple(keys)
 
-        async with self._lock:
-            if keys in self._non_existent:
-                log.info("Clearing non-existent entry %s for table %s", keys, self.table)
-                self._non_existent.remove(keys)
+        if keys in self._non_existent:
+            log.info("Clearing non-existent entry %s for table %s", keys, self.table)
+            self._non_existent.remove(keys)
 
-            removed = bool(self.entries.pop(keys, False))
+        removed = bool(self.entries.pop(keys, False))
 
-            if removed:
-                log.info("Clearing entry %s for table %s", keys, self.table)
+        if removed:
+            log.info("Clearing entry %s for table %s", keys, self.table)
 
-            return removed
+        return removed
@@ -2,6 +2,8 @@ from .configtable import ConfigTableRecord
 
 
 class GuildConfigRecord(ConfigTableRecord):
+    __slots__ = ()
+
     @property
     def mod_role(self):
         if self.mod_role_id is None: